@@ -0,0 +1,254 @@
+# Rule-based achievement engine.
+#
+# Each achievement is a rule registered with the change triggers that can
+# affect it. A progress change yields its triggers: milestone_completed when
+# milestones were completed, and path_completed when the path is now
+# complete. Only the rules registered for those triggers are checked, and
+# rules whose achievement is already held are skipped. Path achievements are
+# added to the progress document, and every unlock is added to the user
+# document. GET /user/{id}/achievements is then one read by the unique "id"
+# index. Achievements are never revoked. Existing data is migrated with:
+#
+#     python achievements.py backfill
+
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, FrozenSet, List
+
+from pymongo import ReturnDocument
+
+from catalog import CATALOG
+from milestone_events import path_started_at
+from progress import completed_milestone_ids
+
+logger = logging.getLogger(__name__)
+
+MILESTONE_COMPLETED = "milestone_completed"
+PATH_COMPLETED = "path_completed"
+
+# Path achievements are also kept on the progress document of that path
+PATH_SCOPE = "path"
+USER_SCOPE = "user"
+
+# A path finished within its estimated days earns speed_demon
+SPEED_DEMON_RATIO = 1.0
+MULTI_PATH_COUNT = 3
+
+
+@dataclass
+class ProgressChange:
+    """A written progress document and whether the write completed milestones"""
+    progress: dict
+    completed: bool = True
+
+
+@dataclass
+class AchievementContext:
+    db: object
+    user_id: str
+    path_id: str
+    progress: dict
+    completed_count: int
+    total: int
+    # Paths the user has completed at some point, from the user document
+    completed_paths: List[str]
+
+
+@dataclass(frozen=True)
+class AchievementRule:
+    id: str
+    scope: str
+    triggers: FrozenSet[str]
+    check: Callable[[AchievementContext], Awaitable[bool]]
+
+
+RULE_REGISTRY: Dict[str, AchievementRule] = {}
+RULES_BY_TRIGGER: Dict[str, List[AchievementRule]] = {}
+
+
+def achievement_rule(achievement_id: str, scope: str, on: FrozenSet[str]):
+    """Register the decorated coroutine as the check of an achievement"""
+    def register(check: Callable[[AchievementContext], Awaitable[bool]]):
+        if achievement_id in RULE_REGISTRY:
+            raise ValueError(f"Duplicate achievement rule: {achievement_id}")
+        rule = AchievementRule(achievement_id, scope, frozenset(on), check)
+        RULE_REGISTRY[achievement_id] = rule
+        for trigger in rule.triggers:
+            RULES_BY_TRIGGER.setdefault(trigger, []).append(rule)
+        return check
+    return register
+
+
+@achievement_rule("first_step", PATH_SCOPE, on={MILESTONE_COMPLETED})
+async def first_step(ctx: AchievementContext) -> bool:
+    return ctx.completed_count >= 1
+
+
+@achievement_rule("halfway_hero", PATH_SCOPE, on={MILESTONE_COMPLETED})
+async def halfway_hero(ctx: AchievementContext) -> bool:
+    return ctx.completed_count * 2 >= ctx.total
+
+
+@achievement_rule("path_master", PATH_SCOPE, on={PATH_COMPLETED})
+async def path_master(ctx: AchievementContext) -> bool:
+    return True
+
+
+@achievement_rule("speed_demon", PATH_SCOPE, on={PATH_COMPLETED})
+async def speed_demon(ctx: AchievementContext) -> bool:
+    started_at = await path_started_at(ctx.db, ctx.user_id, ctx.path_id)
+    if started_at is None:
+        return False
+    if started_at.tzinfo is None:
+        started_at = started_at.replace(tzinfo=timezone.utc)
+    elapsed_days = (datetime.now(timezone.utc) - started_at) / timedelta(days=1)
+    return elapsed_days <= CATALOG.total_days[ctx.path_id] * SPEED_DEMON_RATIO
+
+
+@achievement_rule("multi_path", USER_SCOPE, on={PATH_COMPLETED})
+async def multi_path(ctx: AchievementContext) -> bool:
+    return len(ctx.completed_paths) >= MULTI_PATH_COUNT
+
+
+def _missing_achievements() -> None:
+    # Every catalog achievement needs a rule, or it could never be earned
+    missing = [a["id"] for a in CATALOG.achievements if a["id"] not in RULE_REGISTRY]
+    if missing:
+        raise ValueError(f"Achievements without a rule: {', '.join(missing)}")
+
+
+_missing_achievements()
+
+
+class AchievementEngine:
+    """Evaluates the rules affected by progress changes and stores unlocks"""
+
+    def __init__(self, db):
+        self.db = db
+        self.evaluated = 0
+        self.unlocked = 0
+
+    async def process(self, change: ProgressChange) -> List[str]:
+        """Apply one change; returns the achievements it unlocked
+
+        Path achievements unlocked are also appended to change.progress, so
+        the caller's copy matches what was stored.
+        """
+        progress = change.progress
+        if not progress:
+            return []
+        user_id = progress["user_id"]
+        path_id = progress["career_path_id"]
+        total = CATALOG.milestone_count.get(path_id)
+        if not total:
+            return []
+        completed_count = sum(
+            1 for m in completed_milestone_ids(progress) if CATALOG.milestone_path.get(m) == path_id
+        )
+
+        triggers = set()
+        if change.completed and completed_count:
+            triggers.add(MILESTONE_COMPLETED)
+            if completed_count >= total:
+                triggers.add(PATH_COMPLETED)
+        rules = {rule.id: rule for t in triggers for rule in RULES_BY_TRIGGER.get(t, ())}
+        held = set(progress.get("achievements", []))
+        rules = {i: r for i, r in rules.items() if not (r.scope == PATH_SCOPE and i in held)}
+        if not rules:
+            return []
+
+        user = await self._load_user(user_id, path_id, PATH_COMPLETED in triggers,
+                                     any(r.scope == USER_SCOPE for r in rules.values()))
+        held_by_user = set(user.get("achievements", []))
+        ctx = AchievementContext(
+            db=self.db, user_id=user_id, path_id=path_id, progress=progress,
+            completed_count=completed_count, total=total,
+            completed_paths=user.get("completed_paths", []),
+        )
+        unlocked = []
+        for rule in rules.values():
+            if rule.scope == USER_SCOPE and rule.id in held_by_user:
+                continue
+            self.evaluated += 1
+            if await rule.check(ctx):
+                unlocked.append(rule)
+
+        path_unlocked = [r.id for r in unlocked if r.scope == PATH_SCOPE]
+        if path_unlocked:
+            await self.db.user_progress.update_one(
+                {"user_id": user_id, "career_path_id": path_id},
+                {"$addToSet": {"achievements": {"$each": path_unlocked}}}
+            )
+            progress["achievements"] = progress.get("achievements", []) + path_unlocked
+        if unlocked:
+            await self.db.users.update_one(
+                {"id": user_id},
+                {"$addToSet": {"achievements": {"$each": [r.id for r in unlocked]}}}
+            )
+        self.unlocked += len(unlocked)
+        return [r.id for r in unlocked]
+
+    async def _load_user(self, user_id: str, path_id: str, path_completed: bool,
+                         needs_user: bool) -> dict:
+        projection = {"_id": 0, "achievements": 1, "completed_paths": 1}
+        if path_completed:
+            # Recording the completed path and reading the user back is one round trip
+            user = await self.db.users.find_one_and_update(
+                {"id": user_id},
+                {"$addToSet": {"completed_paths": path_id}},
+                projection=projection,
+                return_document=ReturnDocument.AFTER,
+            )
+        elif needs_user:
+            user = await self.db.users.find_one({"id": user_id}, projection)
+        else:
+            user = None
+        return user or {}
+
+    def stats(self) -> dict:
+        return {
+            "rules": len(RULE_REGISTRY),
+            "evaluated": self.evaluated,
+            "unlocked": self.unlocked,
+        }
+
+
+async def user_achievements(db, user_id: str) -> List[str]:
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "achievements": 1})
+    return (user or {}).get("achievements", [])
+
+
+async def backfill(db, batch_size: int = 1000) -> int:
+    """Evaluate every rule against all stored progress, streaming in batches"""
+    engine = AchievementEngine(db)
+    seen = 0
+    async for progress in db.user_progress.find({}, {"_id": 0}).batch_size(batch_size):
+        await engine.process(ProgressChange(progress))
+        seen += 1
+    return seen
+
+
+if __name__ == "__main__":
+    import typer
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    cli = typer.Typer(help="Maintain stored achievements")
+
+    @cli.callback()
+    def main():
+        """Maintain stored achievements"""
+
+    @cli.command("backfill")
+    def backfill_command():
+        """Unlock achievements earned by existing progress"""
+        db = AsyncIOMotorClient(os.environ['MONGO_URL'])[os.environ['DB_NAME']]
+        seen = asyncio.run(backfill(db))
+        typer.echo(f"Evaluated achievements for {seen} progress documents")
+
+    cli()
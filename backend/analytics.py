@@ -0,0 +1,190 @@
+# Offline milestone funnel analytics.
+#
+# The funnel job streams user_progress in chunks and keeps running counters
+# per (path, cohort). The cohort is the month the progress document was
+# created, taken from its ObjectId, and "all" spans every month. Each chunk
+# becomes a boolean (users x milestones) matrix in milestone order, and NumPy
+# column sums are added to the counters. Memory therefore depends on the
+# chunk size and the catalog size, never on the collection size. The
+# finished funnels replace the previous run's documents in the funnels
+# collection, which /api/admin/funnels serves:
+#
+#     python analytics.py funnels --chunk-size 5000
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pymongo import ReplaceOne
+
+from catalog import CATALOG
+
+logger = logging.getLogger(__name__)
+
+FUNNEL_CHUNK_SIZE = int(os.environ.get("FUNNEL_CHUNK_SIZE", "5000"))
+ALL_COHORTS = "all"
+
+
+class FunnelCounts:
+    """Running funnel counters of one path and cohort"""
+
+    def __init__(self, milestones: int):
+        self.users = 0
+        # Users who completed each milestone
+        self.completed = np.zeros(milestones, dtype=np.int64)
+        # Users who completed each milestone and every milestone before it
+        self.reached = np.zeros(milestones, dtype=np.int64)
+        # Users who completed both milestone i and milestone i + 1
+        self.consecutive = np.zeros(max(milestones - 1, 0), dtype=np.int64)
+
+    def add(self, matrix: np.ndarray) -> None:
+        self.users += matrix.shape[0]
+        self.completed += matrix.sum(axis=0)
+        self.reached += np.logical_and.accumulate(matrix, axis=1).sum(axis=0)
+        self.consecutive += (matrix[:, :-1] & matrix[:, 1:]).sum(axis=0)
+
+
+def completion_matrix(path_id: str, docs: List[dict]) -> np.ndarray:
+    """Boolean (documents x milestones) matrix of one path, columns in milestone order"""
+    milestones = CATALOG.milestone_count[path_id]
+    matrix = np.zeros((len(docs), milestones), dtype=bool)
+    masked = [i for i, doc in enumerate(docs) if "completed_mask" in doc]
+    if masked:
+        masks = np.array([docs[i]["completed_mask"] for i in masked], dtype=np.uint64)
+        bits = np.arange(milestones, dtype=np.uint64)
+        matrix[masked] = ((masks[:, None] >> bits) & np.uint64(1)) == 1
+    rows, columns = [], []
+    for i, doc in enumerate(docs):
+        if "completed_mask" in doc:
+            continue
+        for milestone_id in doc.get("completed_milestones", []):
+            # Ids from other paths or retired milestones are ignored
+            if CATALOG.milestone_path.get(milestone_id) == path_id:
+                rows.append(i)
+                columns.append(CATALOG.milestone_ordinal[milestone_id])
+    matrix[rows, columns] = True
+    return matrix
+
+
+def cohort_of(doc: dict) -> str:
+    return doc["_id"].generation_time.strftime("%Y-%m")
+
+
+def funnel_steps(path_id: str, counts: FunnelCounts) -> List[dict]:
+    """Per-milestone rows with overall and step-to-step conversion"""
+    milestones = [CATALOG.milestone_by_id[m] for m in CATALOG.milestone_ids[path_id]]
+    frame = pd.DataFrame({
+        "milestone_id": [m["id"] for m in milestones],
+        "title": [m["title"] for m in milestones],
+        "order": [m["order"] for m in milestones],
+        "completed": counts.completed,
+        "reached": counts.reached,
+    })
+    users = counts.users or 1
+    # Of the users who completed the previous milestone, the share that completed this one
+    previous = np.concatenate(([counts.users], counts.completed[:-1]))
+    both = np.concatenate((counts.completed[:1], counts.consecutive))
+    frame["completion_rate"] = (frame["completed"] / users).round(4)
+    frame["conditional_rate"] = np.round(np.divide(
+        both, previous, out=np.zeros(len(frame)), where=previous > 0
+    ), 4)
+    frame["drop_off"] = np.where(previous > 0, (1 - frame["conditional_rate"]).round(4), 0.0)
+    return frame.astype({"completed": int, "reached": int, "order": int}).to_dict("records")
+
+
+async def compute_funnels(db, chunk_size: int = FUNNEL_CHUNK_SIZE) -> Tuple[Dict[tuple, FunnelCounts], int]:
+    """Stream user_progress once and return counters keyed by (path_id, cohort)"""
+    counters: Dict[tuple, FunnelCounts] = {}
+    projection = {"career_path_id": 1, "completed_milestones": 1, "completed_mask": 1}
+    cursor = db.user_progress.find({}, projection).batch_size(chunk_size)
+    chunk, seen = [], 0
+
+    def add_chunk():
+        by_key: Dict[tuple, List[dict]] = {}
+        for doc in chunk:
+            path_id = doc.get("career_path_id")
+            if path_id not in CATALOG.milestone_ids:
+                continue
+            by_key.setdefault((path_id, cohort_of(doc)), []).append(doc)
+        for (path_id, cohort), docs in by_key.items():
+            matrix = completion_matrix(path_id, docs)
+            for key in ((path_id, cohort), (path_id, ALL_COHORTS)):
+                if key not in counters:
+                    counters[key] = FunnelCounts(CATALOG.milestone_count[path_id])
+                counters[key].add(matrix)
+
+    async for doc in cursor:
+        chunk.append(doc)
+        if len(chunk) >= chunk_size:
+            add_chunk()
+            seen += len(chunk)
+            chunk = []
+    if chunk:
+        add_chunk()
+        seen += len(chunk)
+    return counters, seen
+
+
+async def run_funnels(db, chunk_size: int = FUNNEL_CHUNK_SIZE) -> int:
+    """Recompute every funnel and replace the stored ones; returns documents scanned"""
+    counters, seen = await compute_funnels(db, chunk_size)
+    generated_at = datetime.now(timezone.utc)
+    ops = [
+        ReplaceOne(
+            {"path_id": path_id, "cohort": cohort},
+            {
+                "path_id": path_id,
+                "path_name": CATALOG.path_by_id[path_id]["name"],
+                "cohort": cohort,
+                "users": counts.users,
+                "steps": funnel_steps(path_id, counts),
+                "catalog_version": CATALOG.version,
+                "generated_at": generated_at,
+            },
+            upsert=True,
+        )
+        for (path_id, cohort), counts in counters.items()
+    ]
+    if ops:
+        await db.funnels.bulk_write(ops, ordered=False)
+    # Funnels whose path or cohort has no documents left
+    await db.funnels.delete_many({"generated_at": {"$ne": generated_at}})
+    logger.info("Computed %d funnels from %d progress documents", len(ops), seen)
+    return seen
+
+
+async def load_funnels(db, path_id: Optional[str] = None, cohort: Optional[str] = None) -> List[dict]:
+    query = {}
+    if path_id:
+        query["path_id"] = path_id
+    if cohort:
+        query["cohort"] = cohort
+    # At most one document per path and month
+    return await db.funnels.find(query, {"_id": 0}).sort([("path_id", 1), ("cohort", 1)]).to_list(None)
+
+
+if __name__ == "__main__":
+    import typer
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    cli = typer.Typer(help="Offline analytics jobs")
+
+    @cli.callback()
+    def main():
+        """Offline analytics jobs"""
+
+    @cli.command("funnels")
+    def funnels_command(chunk_size: int = typer.Option(FUNNEL_CHUNK_SIZE, help="Documents per chunk")):
+        """Recompute milestone completion funnels per path and cohort"""
+        db = AsyncIOMotorClient(os.environ['MONGO_URL'])[os.environ['DB_NAME']]
+        seen = asyncio.run(run_funnels(db, chunk_size))
+        typer.echo(f"Computed funnels from {seen} progress documents")
+
+    cli()
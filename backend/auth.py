@@ -1,60 +1,290 @@
+import asyncio
+import hashlib
+import heapq
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from passlib.context import CryptContext
 import jwt
 import os
 
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "supercharge-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get("ADMIN_EMAILS", "").split(",") if e.strip()}
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Chosen per host with `python auth.py tune`; hashes with another cost are
+# rehashed on the next successful login
+PASSWORD_BCRYPT_ROUNDS = int(os.environ.get("PASSWORD_BCRYPT_ROUNDS", "12"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=PASSWORD_BCRYPT_ROUNDS)
 security = HTTPBearer()
 
+# bcrypt holds the CPU for hundreds of milliseconds per call, so the async
+# handlers run it on a small dedicated pool. The bcrypt module releases the
+# GIL while hashing. When workers + queue are full, new requests fail fast
+# with 503 instead of piling up behind the pool.
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_QUEUE_LIMIT = int(os.environ.get("PASSWORD_QUEUE_LIMIT", "32"))
+
+T = TypeVar("T")
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True when a hash uses an outdated scheme or cost; cheap, no hashing"""
+    return pwd_context.needs_update(hashed_password)
+
+class PasswordPool:
+    """Bounded executor for password hashing with queueing metrics"""
+
+    def __init__(self, workers: int = PASSWORD_WORKERS, queue_limit: int = PASSWORD_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password")
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        if self.in_flight >= self.workers + self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many authentication requests, try again shortly",
+                headers={"Retry-After": "1"}
+            )
+        self.in_flight += 1
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                self._record(started - submitted, time.perf_counter() - started)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self.in_flight -= 1
+
+    def _record(self, waited: float, ran: float) -> None:
+        # Runs on the worker thread; these are counters for metrics only
+        self.completed += 1
+        self.wait_seconds += waited
+        self.run_seconds += ran
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        done = self.completed or 1
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "in_flight": self.in_flight,
+            "queued": max(self.in_flight - self.workers, 0),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.wait_seconds / done * 1000, 2),
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 2),
+            "avg_run_ms": round(self.run_seconds / done * 1000, 2),
+        }
+
+password_pool = PasswordPool()
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_pool.run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await password_pool.run(get_password_hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    # jti identifies the token for revocation
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def decode_token(token: str) -> dict:
+# ================== VERIFIED TOKEN CACHE ==================
+
+# Verified payloads are cached by token digest until the token expires, or
+# for TOKEN_CACHE_TTL_SECONDS at most, so a repeated token skips the HMAC
+# check. Revocation goes through the denylist, which is checked on every
+# request, cached or not. Revocations from other workers arrive through
+# sync_revocations.
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = float(os.environ.get("TOKEN_CACHE_TTL_SECONDS", "300"))
+REVOCATION_SYNC_SECONDS = float(os.environ.get("REVOCATION_SYNC_SECONDS", "10"))
+REVOCATION_SYNC_OVERLAP = timedelta(seconds=60)
+
+token_cache = TTLCache(max_size=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL_SECONDS, name="verified_tokens")
+
+class TokenDenylist:
+    """Revoked token ids until their expiry; never evicted early"""
+
+    def __init__(self):
+        self._expires: dict = {}
+        # (expires_at, key) min-heap, so purging only looks at expired entries
+        self._heap: List[Tuple[float, str]] = []
+
+    def add(self, key: str, expires_at: float) -> None:
+        self._expires[key] = expires_at
+        heapq.heappush(self._heap, (expires_at, key))
+        self._purge()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._expires
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+    def _purge(self) -> None:
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._heap)
+            # A key added again later has a newer heap entry of its own
+            if self._expires.get(key) == expires_at:
+                del self._expires[key]
+
+token_denylist = TokenDenylist()
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def _revocation_key(payload: dict, digest: str) -> str:
+    # Tokens issued before jti existed are revoked by digest
+    return payload.get("jti") or digest
+
+def _verify(token: str) -> dict:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except jwt.ExpiredSignatureError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token has expired"
         )
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials"
         )
 
+def decode_token(token: str) -> dict:
+    digest = token_digest(token)
+    payload = token_cache.get(digest, None)
+    if payload is None:
+        payload = _verify(token)
+        remaining = payload.get("exp", 0) - time.time()
+        token_cache.set(digest, payload, ttl=min(remaining, TOKEN_CACHE_TTL_SECONDS))
+    if _revocation_key(payload, digest) in token_denylist:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has been revoked"
+        )
+    return dict(payload)
+
+def revoke_token(token: str) -> dict:
+    """Revoke a valid token on this worker; returns the record other workers need"""
+    payload = decode_token(token)
+    digest = token_digest(token)
+    key = _revocation_key(payload, digest)
+    token_denylist.add(key, payload["exp"])
+    token_cache.invalidate(digest)
+    return {
+        "key": key,
+        "expires_at": datetime.fromtimestamp(payload["exp"], timezone.utc),
+        "revoked_at": datetime.now(timezone.utc),
+    }
+
+async def sync_revocations(db, interval: float = REVOCATION_SYNC_SECONDS) -> None:
+    """Poll revoked_tokens and add new revocations to this worker's denylist"""
+    since = None
+    while True:
+        try:
+            # Overlap the previous poll so records written with a lagging clock are not skipped
+            query = {"revoked_at": {"$gt": since - REVOCATION_SYNC_OVERLAP}} if since else {}
+            async for record in db.revoked_tokens.find(query, {"_id": 0}).sort("revoked_at", 1):
+                expires_at = record["expires_at"]
+                if expires_at.tzinfo is None:
+                    expires_at = expires_at.replace(tzinfo=timezone.utc)
+                token_denylist.add(record["key"], expires_at.timestamp())
+                since = record["revoked_at"]
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Failed to sync revoked tokens")
+        await asyncio.sleep(interval)
+
+# ================== STREAM TICKETS ==================
+
+# EventSource cannot send headers, so the progress stream takes a ticket in
+# the query string instead of the access token. Tickets are short-lived,
+# carry scope "stream" and are accepted nowhere else. A worker refuses a
+# ticket it has already accepted once.
+STREAM_SCOPE = "stream"
+STREAM_TICKET_SECONDS = int(os.environ.get("STREAM_TICKET_SECONDS", "60"))
+
+def create_stream_ticket(user_id: str) -> str:
+    return create_access_token(
+        {"sub": user_id, "scope": STREAM_SCOPE},
+        expires_delta=timedelta(seconds=STREAM_TICKET_SECONDS)
+    )
+
+def redeem_stream_ticket(ticket: str) -> str:
+    """The user id of a valid, unused stream ticket"""
+    payload = decode_token(ticket)
+    if payload.get("scope") != STREAM_SCOPE or payload.get("sub") is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials"
+        )
+    token_denylist.add(_revocation_key(payload, token_digest(ticket)), payload["exp"])
+    return payload["sub"]
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     token = credentials.credentials
     payload = decode_token(token)
     user_id = payload.get("sub")
-    if user_id is None:
+    # Scoped tokens such as stream tickets are not access tokens
+    if user_id is None or "scope" in payload:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials"
         )
     return {"user_id": user_id, "email": payload.get("email")}
 
+async def get_admin_user(current_user: dict = Depends(get_current_user)) -> dict:
+    email = (current_user.get("email") or "").lower()
+    if email not in ADMIN_EMAILS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
+
 # Optional auth - returns None if no token provided
 async def get_current_user_optional(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> Optional[dict]:
     if credentials is None:
@@ -63,3 +293,56 @@ async def get_current_user_optional(credentials: Optional[HTTPAuthorizationCrede
         return await get_current_user(credentials)
     except HTTPException:
         return None
+
+# ================== COST TUNING ==================
+
+def measure_bcrypt(rounds: int, samples: int, concurrency: int) -> List[float]:
+    """Wall-clock milliseconds of `samples` hashes at `rounds`, `concurrency` at a time"""
+    import bcrypt
+
+    def one(_) -> float:
+        started = time.perf_counter()
+        bcrypt.hashpw(b"password-cost-benchmark", bcrypt.gensalt(rounds))
+        return (time.perf_counter() - started) * 1000
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(one, range(samples)))
+
+def tune_bcrypt_rounds(target_ms: float, samples: int, concurrency: int,
+                       min_rounds: int = 10, max_rounds: int = 16) -> Tuple[int, Dict[int, float]]:
+    """Highest rounds whose p99 stays within target_ms, and the p99 of each cost tried"""
+    p99s: Dict[int, float] = {}
+    chosen = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        timings = sorted(measure_bcrypt(rounds, samples, concurrency))
+        p99s[rounds] = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        if p99s[rounds] > target_ms:
+            # Each extra round doubles the cost, so higher ones only get slower
+            break
+        chosen = rounds
+    return chosen, p99s
+
+if __name__ == "__main__":
+    import typer
+
+    cli = typer.Typer(help="Password hashing tools")
+
+    @cli.callback()
+    def main():
+        """Password hashing tools"""
+
+    @cli.command("tune")
+    def tune_command(
+        target_ms: float = typer.Option(250, help="Latency budget for one hash at p99"),
+        samples: int = typer.Option(20, help="Hashes measured per cost"),
+        concurrency: int = typer.Option(PASSWORD_WORKERS, help="Hashes run in parallel, like the password pool"),
+    ):
+        """Benchmark bcrypt on this host and pick the cost for a p99 target"""
+        chosen, p99s = tune_bcrypt_rounds(target_ms, samples, concurrency)
+        for rounds, p99 in p99s.items():
+            typer.echo(f"rounds={rounds:<3} p99={p99:8.1f} ms")
+        if p99s[min(p99s)] > target_ms:
+            typer.echo(f"Even {min(p99s)} rounds exceed {target_ms} ms; not going below it")
+        typer.echo(f"PASSWORD_BCRYPT_ROUNDS={chosen}")
+
+    cli()
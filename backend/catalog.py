@@ -0,0 +1,182 @@
+# Catalog snapshot and index over the static career path and quiz data.
+#
+# The snapshot is validated, frozen and given deterministic ids and timestamps
+# once at import, so every worker serializes the catalog to identical bytes.
+# The index lets request handlers resolve paths, milestones and questions by
+# id in O(1) instead of scanning ENHANCED_CAREER_PATHS.
+
+import hashlib
+import json
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
+
+from enhanced_data import (
+    ACHIEVEMENTS,
+    CATALOG_PUBLISHED_AT,
+    ENHANCED_CAREER_PATHS,
+    SKILL_ASSESSMENT_QUESTIONS,
+)
+from http_cache import RenderedBody
+
+# Namespace for ids derived from catalog content when the data omits them
+CATALOG_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "supercharge/catalog")
+
+# ================== MODELS ==================
+
+class Resource(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    title: str
+    url: str
+    type: str  # video, article, course
+
+class Milestone(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    title: str
+    description: str
+    order: int
+    resources: Tuple[Resource, ...]
+    estimated_days: int
+
+class CareerPath(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    name: str
+    description: str
+    icon: str
+    color: str
+    milestones: Tuple[Milestone, ...]
+    created_at: datetime
+
+career_paths_adapter = TypeAdapter(Tuple[CareerPath, ...])
+
+# ================== PROJECTIONS ==================
+
+# Fields a client may select with ?fields=; the last two are derived
+PROJECTABLE_FIELDS = (
+    "id", "name", "description", "icon", "color", "milestones", "created_at",
+    "milestone_count", "total_estimated_days",
+)
+
+CATALOG_VIEWS = {
+    "full": None,
+    "summary": ("id", "name", "description", "icon", "color",
+                "milestone_count", "total_estimated_days"),
+}
+
+
+def resolve_projection(fields: Optional[str], view: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Normalize ?fields= / ?view= into a canonical field tuple, or None for the full document"""
+    if fields:
+        requested = {f.strip() for f in fields.split(",") if f.strip()}
+        unknown = requested.difference(PROJECTABLE_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        requested.add("id")
+        return tuple(f for f in PROJECTABLE_FIELDS if f in requested)
+    if view:
+        if view not in CATALOG_VIEWS:
+            raise ValueError(f"Unknown view: {view}")
+        return CATALOG_VIEWS[view]
+    return None
+
+# ================== SNAPSHOT ==================
+
+def _stable_id(*parts: str) -> str:
+    return str(uuid.uuid5(CATALOG_NAMESPACE, "/".join(parts)))
+
+
+def build_snapshot(paths: List[dict], published_at: str) -> Tuple[CareerPath, ...]:
+    """Validate the raw catalog into frozen models with deterministic fields"""
+    normalized = []
+    for path in paths:
+        path_data = dict(path)
+        path_data.setdefault("id", _stable_id(path["name"]))
+        path_data.setdefault("created_at", published_at)
+        path_data["milestones"] = [
+            {"id": _stable_id(path_data["id"], m["title"]), **m}
+            for m in path["milestones"]
+        ]
+        normalized.append(path_data)
+    return career_paths_adapter.validate_python(normalized)
+
+
+class CatalogIndex:
+    """Frozen catalog snapshot plus lookup tables derived from it"""
+
+    def __init__(self, paths: List[dict], questions: List[dict], achievements: List[dict],
+                 published_at: str):
+        self.snapshot = build_snapshot(paths, published_at)
+        self.snapshot_by_id: Dict[str, CareerPath] = {p.id: p for p in self.snapshot}
+        self.paths = [p.model_dump(mode="json") for p in self.snapshot]
+        self.questions = questions
+        self.achievements = achievements
+        self.path_by_id: Dict[str, dict] = {}
+        self.milestone_by_id: Dict[str, dict] = {}
+        self.milestone_path: Dict[str, str] = {}
+        self.milestone_ordinal: Dict[str, int] = {}
+        self.milestone_ids: Dict[str, List[str]] = {}
+        self.milestone_count: Dict[str, int] = {}
+        self.total_days: Dict[str, int] = {}
+
+        for path in self.paths:
+            path_id = path["id"]
+            if path_id in self.path_by_id:
+                raise ValueError(f"Duplicate career path id: {path_id}")
+            self.path_by_id[path_id] = path
+
+            # Ordinals follow the milestone "order" field, not list position
+            milestones = sorted(path["milestones"], key=lambda m: m["order"])
+            ids = []
+            for ordinal, milestone in enumerate(milestones):
+                milestone_id = milestone["id"]
+                if milestone_id in self.milestone_by_id:
+                    raise ValueError(f"Duplicate milestone id: {milestone_id}")
+                self.milestone_by_id[milestone_id] = milestone
+                self.milestone_path[milestone_id] = path_id
+                self.milestone_ordinal[milestone_id] = ordinal
+                ids.append(milestone_id)
+
+            self.milestone_ids[path_id] = ids
+            self.milestone_count[path_id] = len(ids)
+            self.total_days[path_id] = sum(m["estimated_days"] for m in milestones)
+
+        # Every projectable field per path, ready to be sliced into projections
+        self.projectable: Dict[str, dict] = {
+            path["id"]: {
+                **path,
+                "milestone_count": self.milestone_count[path["id"]],
+                "total_estimated_days": self.total_days[path["id"]],
+            }
+            for path in self.paths
+        }
+
+        # Content hash of the snapshot; identifies this catalog version
+        source = json.dumps([self.paths, questions, achievements], sort_keys=True)
+        self.version = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+        self._rendered: Dict[Hashable, RenderedBody] = {}
+
+    def get_path(self, path_id: str) -> Optional[dict]:
+        return self.path_by_id.get(path_id)
+
+    def project(self, path_id: str, fields: Tuple[str, ...]) -> dict:
+        doc = self.projectable[path_id]
+        return {f: doc[f] for f in fields}
+
+    def rendered(self, key: Hashable, build: Callable[[], RenderedBody]) -> RenderedBody:
+        """Render a response body once for this catalog version and reuse it"""
+        body = self._rendered.get(key)
+        if body is None:
+            body = self._rendered[key] = build()
+        return body
+
+
+CATALOG = CatalogIndex(
+    ENHANCED_CAREER_PATHS,
+    SKILL_ASSESSMENT_QUESTIONS,
+    ACHIEVEMENTS,
+    CATALOG_PUBLISHED_AT,
+)
@@ -0,0 +1,220 @@
+# Server-side certificate rendering with a content-addressed artifact store.
+#
+# Certificates are rendered to PDF (always available, written directly with
+# the standard Helvetica fonts) or PNG (when Pillow is installed). Rendering
+# runs off the event loop in a process pool whose workers start from a
+# forkserver. Output is deterministic, so every artifact is stored once in
+# certificate_artifacts under the sha256 of its bytes. Each certificate
+# records the digest per format and renderer version. Repeat downloads are
+# then one indexed read, or a 304 when the client already holds that digest
+# as its ETag. Bumping RENDERER_VERSION makes every certificate render again
+# on its next download.
+
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from io import BytesIO
+from typing import Optional, Tuple
+
+from bson import Binary
+
+from cache import TTLCache
+from catalog import CATALOG
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:  # PNG output is optional
+    Image = None
+
+RENDERER_VERSION = 1
+CERTIFICATE_RENDER_WORKERS = int(os.environ.get("CERTIFICATE_RENDER_WORKERS", "2"))
+ARTIFACT_CACHE_SIZE = int(os.environ.get("CERTIFICATE_ARTIFACT_CACHE_SIZE", "256"))
+ARTIFACT_CACHE_CONTROL = "public, max-age=86400"
+
+MEDIA_TYPES = {"pdf": "application/pdf", "png": "image/png"}
+
+PAGE_WIDTH, PAGE_HEIGHT = 842, 595  # A4 landscape, in points
+EMERALD = (0.063, 0.725, 0.506)
+CYAN = (0.024, 0.714, 0.831)
+PURPLE = (0.463, 0.294, 0.635)
+GREY = (0.333, 0.333, 0.333)
+
+# Helvetica advance widths for ASCII 32-126, in 1/1000 em, from the AFM metrics
+_HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+# Bold glyphs are about this much wider on average; close enough for centering
+_BOLD_FACTOR = 1.07
+
+
+def available_formats() -> Tuple[str, ...]:
+    return ("pdf", "png") if Image is not None else ("pdf",)
+
+
+def certificate_lines(certificate: dict) -> list:
+    """(text, size, bold, color) rows of the certificate, top to bottom"""
+    completed = datetime.fromisoformat(certificate["completion_date"])
+    achievement_names = {a["id"]: a["name"] for a in CATALOG.achievements}
+    achievements = ", ".join(achievement_names.get(a, a) for a in certificate.get("achievements", []))
+    lines = [
+        ("SUPERCHARGE", 40, True, EMERALD),
+        ("Certificate of Completion", 26, False, GREY),
+        ("This is to certify that", 16, False, GREY),
+        (certificate["user_name"], 34, True, PURPLE),
+        ("has successfully completed", 16, False, GREY),
+        (certificate["path_name"], 24, True, GREY),
+        (f"completing all {certificate['total_milestones']} milestones", 14, False, GREY),
+    ]
+    if achievements:
+        lines.append((f"Achievements: {achievements}", 13, False, EMERALD))
+    lines.append((f"Completed on {completed.strftime('%B')} {completed.day}, {completed.year}", 14, False, GREY))
+    return lines
+
+
+def _pdf_text(text: str) -> bytes:
+    raw = text.encode("latin-1", errors="replace")
+    return raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def _text_width(text: str, size: float, bold: bool) -> float:
+    units = sum(_HELVETICA_WIDTHS[ord(c) - 32] if 32 <= ord(c) <= 126 else 556 for c in text)
+    return units * size / 1000 * (_BOLD_FACTOR if bold else 1)
+
+
+def render_pdf(certificate: dict) -> bytes:
+    """A one-page PDF of the certificate; the same input always gives the same bytes"""
+    ops = [
+        b"%.3f %.3f %.3f rg 0 0 %d %d re f" % (*EMERALD, PAGE_WIDTH, PAGE_HEIGHT),
+        b"1 1 1 rg 20 20 %d %d re f" % (PAGE_WIDTH - 40, PAGE_HEIGHT - 40),
+        b"%.3f %.3f %.3f RG 3 w 34 34 %d %d re S" % (*CYAN, PAGE_WIDTH - 68, PAGE_HEIGHT - 68),
+    ]
+    y = PAGE_HEIGHT - 110
+    for text, size, bold, color in certificate_lines(certificate):
+        x = (PAGE_WIDTH - _text_width(text, size, bold)) / 2
+        ops.append(b"BT /%s %d Tf %.3f %.3f %.3f rg %.2f %.2f Td (%s) Tj ET" % (
+            b"F2" if bold else b"F1", size, *color, x, y, _pdf_text(text)))
+        y -= size * 1.9
+    stream = zlib.compress(b"\n".join(ops), 9)
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R /F2 6 0 R >> >> >>" % (PAGE_WIDTH, PAGE_HEIGHT),
+        b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(stream), stream),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+    ]
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def render_png(certificate: dict) -> bytes:
+    """The certificate as a PNG at twice the PDF's point size; needs Pillow"""
+    scale = 2
+    width, height = PAGE_WIDTH * scale, PAGE_HEIGHT * scale
+
+    def rgb(color):
+        return tuple(round(c * 255) for c in color)
+
+    image = Image.new("RGB", (width, height), rgb(EMERALD))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([20 * scale, 20 * scale, width - 20 * scale, height - 20 * scale], fill="white")
+    draw.rectangle([34 * scale, 34 * scale, width - 34 * scale, height - 34 * scale],
+                   outline=rgb(CYAN), width=3 * scale)
+    y = 110 * scale
+    for text, size, _bold, color in certificate_lines(certificate):
+        font = ImageFont.load_default(size=size * scale)
+        draw.text((width / 2, y), text, font=font, fill=rgb(color), anchor="ms")
+        y += size * 1.9 * scale
+    buffer = BytesIO()
+    # No metadata, so the output stays deterministic
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+RENDERERS = {"pdf": render_pdf, "png": render_png}
+
+
+class CertificateRenderer:
+    """Renders certificates in a process pool and stores the artifacts by digest"""
+
+    def __init__(self, db, workers: int = CERTIFICATE_RENDER_WORKERS):
+        self.db = db
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._cache = TTLCache(max_size=ARTIFACT_CACHE_SIZE, ttl=3600, name="certificate_artifacts")
+        self.rendered = 0
+
+    @staticmethod
+    def artifact_key(fmt: str) -> str:
+        return f"{fmt}-v{RENDERER_VERSION}"
+
+    def stored_digest(self, certificate: dict, fmt: str) -> Optional[str]:
+        return certificate.get("artifacts", {}).get(self.artifact_key(fmt))
+
+    async def artifact(self, certificate: dict, fmt: str) -> Tuple[str, bytes]:
+        """(digest, bytes) of a certificate in a format, rendering it at most once"""
+        digest = self.stored_digest(certificate, fmt)
+        if digest:
+            data = await self._load(digest)
+            if data is not None:
+                return digest, data
+
+        if self._pool is None:
+            # Forking a worker that runs Motor's and the password pool's threads
+            # can deadlock the child; rendering only needs a clean interpreter
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("forkserver")
+            )
+        source = {k: v for k, v in certificate.items() if k != "artifacts"}
+        data = await asyncio.get_running_loop().run_in_executor(self._pool, RENDERERS[fmt], source)
+        self.rendered += 1
+        digest = hashlib.sha256(data).hexdigest()
+        await self.db.certificate_artifacts.update_one(
+            {"_id": digest},
+            {"$setOnInsert": {
+                "media_type": MEDIA_TYPES[fmt],
+                "data": Binary(data),
+                "size": len(data),
+                "created_at": datetime.now(timezone.utc),
+            }},
+            upsert=True,
+        )
+        await self.db.certificates.update_one(
+            {"id": certificate["id"]},
+            {"$set": {f"artifacts.{self.artifact_key(fmt)}": digest}}
+        )
+        self._cache.set(digest, data)
+        return digest, data
+
+    async def _load(self, digest: str) -> Optional[bytes]:
+        async def load():
+            artifact = await self.db.certificate_artifacts.find_one({"_id": digest}, {"data": 1})
+            return bytes(artifact["data"]) if artifact else None
+        return await self._cache.get_or_load(digest, load)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {"rendered": self.rendered, "formats": list(available_formats()), **self._cache.stats()}
@@ -1,5 +1,8 @@
 # Enhanced Career Paths Data with More Paths and Milestones
 
+# Publication timestamp of this catalog revision; bump it when the data changes
+CATALOG_PUBLISHED_AT = "2025-11-19T00:00:00+00:00"
+
 ENHANCED_CAREER_PATHS = [
     {
         "id": "software-dev",
@@ -992,3 +995,43 @@ SKILL_ASSESSMENT_QUESTIONS = [
         ]
     }
 ]
+
+
+# Achievements that can be earned across career paths
+ACHIEVEMENTS = [
+    {
+        "id": "first_step",
+        "name": "First Step",
+        "description": "Complete your first milestone",
+        "icon": "🎯",
+        "color": "#10B981"
+    },
+    {
+        "id": "halfway_hero",
+        "name": "Halfway Hero",
+        "description": "Complete 50% of a career path",
+        "icon": "🚀",
+        "color": "#3B82F6"
+    },
+    {
+        "id": "path_master",
+        "name": "Path Master",
+        "description": "Complete an entire career path",
+        "icon": "👑",
+        "color": "#F59E0B"
+    },
+    {
+        "id": "speed_demon",
+        "name": "Speed Demon",
+        "description": "Complete a path in record time",
+        "icon": "⚡",
+        "color": "#EF4444"
+    },
+    {
+        "id": "multi_path",
+        "name": "Multi-Path Master",
+        "description": "Complete 3 different career paths",
+        "icon": "🌟",
+        "color": "#8B5CF6"
+    }
+]
@@ -0,0 +1,149 @@
+# In-process pub/sub for live progress updates, served as server-sent events.
+#
+# Handlers publish progress changes to the hub, and every open
+# /api/stream/progress connection of that user receives them. When MongoDB
+# change streams are available (replica sets), the hub is fed from a change
+# stream on user_progress instead, so writes made by other uvicorn workers
+# reach this worker's subscribers too; local publishes are then skipped to
+# avoid delivering each change twice.
+
+import asyncio
+import json
+import logging
+import os
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from progress import to_api
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_CHANGE_STREAMS = os.environ.get("PROGRESS_CHANGE_STREAMS", "auto")
+SUBSCRIBER_QUEUE_SIZE = 100
+HEARTBEAT_SECONDS = 15
+CHANGE_STREAM_RETRY_SECONDS = 5
+
+# Server error code for change streams on a standalone mongod
+CHANGE_STREAM_UNSUPPORTED = 40573
+
+
+class ProgressEventHub:
+    """Fans progress events out to the subscribers of each user"""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._watcher: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[str], None]] = []
+        self.change_stream_active = False
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def add_listener(self, listener: Callable[[str], None]) -> None:
+        """Call listener(user_id) for every change seen on the change stream, from any worker"""
+        self._listeners.append(listener)
+
+    def publish(self, user_id: str, event: dict) -> None:
+        """Publish a change made by this worker"""
+        if not self.change_stream_active:
+            self._deliver(user_id, event)
+
+    def _deliver(self, user_id: str, event: dict) -> None:
+        for queue in self._subscribers.get(user_id, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A slow client missed events; tell it to refetch instead
+                self.dropped += queue.qsize()
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync"})
+        self.published += 1
+
+    async def stream(self, user_id: str, is_disconnected) -> AsyncIterator[str]:
+        """Yield server-sent event frames for a user until the client goes away"""
+        queue = self.subscribe(user_id)
+        try:
+            yield "retry: 3000\n\n"
+            while not await is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+        finally:
+            self.unsubscribe(user_id, queue)
+
+    def start(self, db) -> None:
+        if PROGRESS_CHANGE_STREAMS != "off" and self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch(db))
+
+    async def close(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        self.change_stream_active = False
+
+    async def _watch(self, db) -> None:
+        resume_token = None
+        while True:
+            try:
+                async with db.user_progress.watch(
+                    full_document="updateLookup", resume_after=resume_token
+                ) as change_stream:
+                    self.change_stream_active = True
+                    logger.info("Progress events are fed from a change stream")
+                    async for change in change_stream:
+                        resume_token = change_stream.resume_token
+                        progress = change.get("fullDocument")
+                        if progress:
+                            for listener in self._listeners:
+                                listener(progress["user_id"])
+                            self._deliver(progress["user_id"], progress_event(to_api(progress)))
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                self.change_stream_active = False
+                if e.code == CHANGE_STREAM_UNSUPPORTED:
+                    logger.info("Change streams unavailable; progress events stay in-process")
+                    return
+                logger.warning("Progress change stream failed: %s", e)
+                resume_token = None
+            except PyMongoError as e:
+                self.change_stream_active = False
+                logger.warning("Progress change stream interrupted: %s", e)
+            await asyncio.sleep(CHANGE_STREAM_RETRY_SECONDS)
+
+
+def progress_event(progress: dict) -> dict:
+    """Event carrying the full state of one path's progress"""
+    return {
+        "type": "progress",
+        "path_id": progress["career_path_id"],
+        "completed_milestones": progress.get("completed_milestones", []),
+        "achievements": progress.get("achievements", []),
+        "updated_at": progress.get("updated_at"),
+    }
+
+
+def milestone_event(path_id: str, milestone_id: str, completed: bool) -> dict:
+    """Event carrying a single milestone toggle"""
+    return {
+        "type": "milestone",
+        "path_id": path_id,
+        "milestone_id": milestone_id,
+        "completed": completed,
+    }
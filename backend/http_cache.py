@@ -0,0 +1,54 @@
+# Helpers for serving JSON bodies rendered once to bytes, with strong ETags
+# and If-None-Match revalidation.
+
+import hashlib
+import json
+
+from fastapi import Request
+from fastapi.responses import Response
+
+CATALOG_CACHE_CONTROL = "public, max-age=300"
+# Per-user bodies: browsers keep them but revalidate every time
+PROFILE_CACHE_CONTROL = "private, no-cache"
+
+
+class RenderedBody:
+    """A JSON response body rendered to bytes once, with its strong ETag"""
+
+    __slots__ = ("body", "etag")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def render_json(data) -> RenderedBody:
+    """Render plain JSON-compatible data to a RenderedBody"""
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return RenderedBody(body.encode("utf-8"))
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Check the request's If-None-Match header against an ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        # If-None-Match uses the weak comparison function
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def cached_json_response(request: Request, rendered: RenderedBody,
+                         cache_control: str = CATALOG_CACHE_CONTROL) -> Response:
+    """Serve a rendered body, or 304 Not Modified when the client's copy is current"""
+    headers = {"ETag": rendered.etag, "Cache-Control": cache_control}
+    if etag_matches(request, rendered.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=rendered.body, media_type="application/json", headers=headers)
@@ -0,0 +1,174 @@
+# Declarative MongoDB index registry.
+#
+# Every query the API runs by key has its index registered here. The server
+# applies the registry idempotently at startup, and the CLI reports indexes
+# that are missing from the database or never used:
+#
+#     python indexes.py report
+#     python indexes.py apply
+
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+IndexKeys = Sequence[Tuple[str, int]]
+
+INDEX_REGISTRY: Dict[str, List[IndexModel]] = {}
+
+
+def register_index(collection: str, keys: IndexKeys, **options) -> None:
+    """Declare an index; options are passed through to pymongo's IndexModel"""
+    INDEX_REGISTRY.setdefault(collection, []).append(IndexModel(list(keys), **options))
+
+
+register_index("users", [("email", ASCENDING)], name="email_unique", unique=True)
+register_index("users", [("id", ASCENDING)], name="id_unique", unique=True)
+register_index(
+    "user_progress",
+    [("user_id", ASCENDING), ("career_path_id", ASCENDING)],
+    name="user_path_unique",
+    unique=True,
+)
+register_index("certificates", [("id", ASCENDING)], name="id_unique", unique=True)
+register_index("certificates", [("user_id", ASCENDING), ("_id", ASCENDING)], name="user_id_id")
+register_index("shared_progress", [("id", ASCENDING)], name="id_unique", unique=True)
+register_index(
+    "milestone_events",
+    [("user_id", ASCENDING), ("path_id", ASCENDING), ("at", ASCENDING)],
+    name="user_path_at",
+)
+register_index("milestone_events", [("at", ASCENDING)], name="at")
+register_index(
+    "leaderboard",
+    [("board", ASCENDING), ("user_id", ASCENDING)],
+    name="board_user_unique",
+    unique=True,
+)
+register_index(
+    "leaderboard",
+    [("board", ASCENDING), ("score", DESCENDING), ("user_id", ASCENDING)],
+    name="board_score",
+)
+register_index(
+    "leaderboard_scores",
+    [("board", ASCENDING), ("score", ASCENDING)],
+    name="board_score_unique",
+    unique=True,
+)
+register_index("leaderboard_sizes", [("board", ASCENDING)], name="board_unique", unique=True)
+register_index(
+    "milestone_summaries",
+    [("user_id", ASCENDING), ("path_id", ASCENDING)],
+    name="user_path_unique",
+    unique=True,
+)
+register_index("revoked_tokens", [("key", ASCENDING)], name="key_unique", unique=True)
+register_index("revoked_tokens", [("revoked_at", ASCENDING)], name="revoked_at")
+# Revocations are dropped once the token would have expired anyway
+register_index("revoked_tokens", [("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0)
+register_index(
+    "funnels",
+    [("path_id", ASCENDING), ("cohort", ASCENDING)],
+    name="path_cohort_unique",
+    unique=True,
+)
+
+
+def _key_spec(index: dict) -> tuple:
+    # Servers may report directions as floats (1.0); normalize before comparing
+    return tuple(
+        (field, int(direction) if isinstance(direction, (int, float)) else direction)
+        for field, direction in index["key"].items()
+    )
+
+
+async def ensure_indexes(db) -> None:
+    """Create every registered index; safe to run on each startup"""
+    for collection, models in INDEX_REGISTRY.items():
+        try:
+            await db[collection].create_indexes(models)
+        except OperationFailure as e:
+            # Conflicting options or duplicate data; leave the collection as is
+            # so the API still starts, and surface it for an operator
+            logger.error("Could not create indexes on %s: %s", collection, e)
+
+
+def index_report(db) -> List[dict]:
+    """Compare the registry against a synchronous pymongo database handle"""
+    rows = []
+    for collection in sorted(INDEX_REGISTRY):
+        existing = {
+            _key_spec(index): index["name"]
+            for index in db[collection].list_indexes()
+        }
+        try:
+            usage = {
+                stat["name"]: stat["accesses"]["ops"]
+                for stat in db[collection].aggregate([{"$indexStats": {}}])
+            }
+        except OperationFailure:
+            usage = {}
+
+        registered = set()
+        for model in INDEX_REGISTRY[collection]:
+            spec = _key_spec(model.document)
+            registered.add(spec)
+            name = existing.get(spec)
+            rows.append({
+                "collection": collection,
+                "index": model.document["name"],
+                "status": "present" if name else "missing",
+                "ops": usage.get(name),
+            })
+
+        for spec, name in existing.items():
+            if name == "_id_" or spec in registered:
+                continue
+            rows.append({
+                "collection": collection,
+                "index": name,
+                "status": "unregistered",
+                "ops": usage.get(name),
+            })
+    return rows
+
+
+if __name__ == "__main__":
+    import typer
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    cli = typer.Typer(help="Manage the API's MongoDB indexes")
+
+    def _database():
+        return MongoClient(os.environ['MONGO_URL'])[os.environ['DB_NAME']]
+
+    @cli.command()
+    def report():
+        """List missing, unregistered and unused indexes"""
+        problems = 0
+        for row in index_report(_database()):
+            unused = row["ops"] == 0
+            if row["status"] != "present" or unused:
+                problems += 1
+            ops = "-" if row["ops"] is None else row["ops"]
+            flag = " (unused)" if unused else ""
+            typer.echo(f"{row['collection']:<16} {row['index']:<20} {row['status']:<13} ops={ops}{flag}")
+        raise typer.Exit(code=1 if problems else 0)
+
+    @cli.command()
+    def apply():
+        """Create every registered index"""
+        db = _database()
+        for collection, models in INDEX_REGISTRY.items():
+            names = db[collection].create_indexes(models)
+            typer.echo(f"{collection}: {', '.join(names)}")
+
+    cli()
@@ -0,0 +1,247 @@
+# Incrementally maintained leaderboards.
+#
+# The leaderboard collection holds one {board, user_id, score} document per
+# user and board:
+#   - "<path_id>": completed milestones on that path
+#   - "global": completed milestones across all paths
+#   - "speed:<path_id>": days taken to complete the path (lower is better)
+# Progress writes feed post-write documents in. Each path score is $set, and
+# the previous value comes back from the same call, so the global score moves
+# by the difference with $inc. Concurrent updates therefore add up to the
+# right total. Every progress write bumps the document's version, and a path
+# entry is only replaced by a newer version, so background updates that
+# finish out of order cannot roll a score back. Top-N queries are index
+# scans on (board, score).
+#
+# Ranks come from a per-board score histogram in leaderboard_scores, one
+# {board, score, users} document per distinct score, moved along with every
+# entry change, and a per-board entry count in leaderboard_sizes. Milestone
+# scores are small integers, so a rank sums a handful of documents however
+# many users are on the board. Speed boards get one bucket per distinct
+# time, which is stored rounded to a thousandth of a day. Boards written
+# before the histogram existed need one rebuild to fill it.
+#
+#     python leaderboard.py rebuild    # recompute every board from user_progress
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, List, Optional, Set
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from catalog import CATALOG
+from milestone_events import path_started_at
+from progress import completed_milestone_ids
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_BOARD = "global"
+SPEED_PREFIX = "speed:"
+
+
+def valid_completed_count(progress: dict) -> int:
+    path_id = progress["career_path_id"]
+    return sum(1 for m in completed_milestone_ids(progress) if CATALOG.milestone_path.get(m) == path_id)
+
+
+def board_name(board: str, metric: str) -> str:
+    return SPEED_PREFIX + board if metric == "speed" else board
+
+
+def is_ascending(board: str) -> bool:
+    return board.startswith(SPEED_PREFIX)
+
+
+class Leaderboards:
+    """Applies progress changes to the materialized leaderboard collection"""
+
+    def __init__(self, db):
+        self.db = db
+        self._tasks: Set[asyncio.Task] = set()
+
+    def schedule(self, progress_docs: Iterable[dict]) -> None:
+        """Update the boards in the background so the request does not wait"""
+        docs = [doc for doc in progress_docs if doc]
+        if not docs:
+            return
+        task = asyncio.create_task(self.record(docs))
+        self._tasks.add(task)
+        task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error("Leaderboard update failed", exc_info=task.exception())
+
+    async def close(self) -> None:
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def record(self, progress_docs: List[dict]) -> None:
+        now = datetime.now(timezone.utc)
+        for progress in progress_docs:
+            user_id = progress["user_id"]
+            path_id = progress["career_path_id"]
+            if not CATALOG.get_path(path_id):
+                continue
+            score = valid_completed_count(progress)
+            version = progress.get("version", 0)
+            query = {"board": path_id, "user_id": user_id, "version": {"$not": {"$gte": version}}}
+            update = {"$set": {"score": score, "version": version, "updated_at": now}}
+            try:
+                previous = await self._set_entry(query, update, upsert=True)
+            except DuplicateKeyError:
+                # Lost the insert of a new entry to another update, or the entry
+                # already holds a newer version; a plain update tells them apart
+                previous = await self._set_entry(query, update, upsert=False)
+                if previous is None:
+                    continue
+            old_score = previous.get("score") if previous else None
+            await self._move(path_id, old_score, score)
+            delta = score - (old_score or 0)
+            if delta:
+                previous = await self.db.leaderboard.find_one_and_update(
+                    {"board": GLOBAL_BOARD, "user_id": user_id},
+                    {"$inc": {"score": delta}, "$set": {"updated_at": now}},
+                    upsert=True,
+                    projection={"_id": 0, "score": 1},
+                    return_document=ReturnDocument.BEFORE,
+                )
+                old_total = previous.get("score") if previous else None
+                await self._move(GLOBAL_BOARD, old_total, (old_total or 0) + delta)
+            if score == CATALOG.milestone_count[path_id]:
+                await self._record_speed(user_id, path_id, now)
+
+    async def _set_entry(self, query: dict, update: dict, upsert: bool) -> Optional[dict]:
+        return await self.db.leaderboard.find_one_and_update(
+            query, update, upsert=upsert,
+            projection={"_id": 0, "score": 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+
+    async def _move(self, board: str, old_score, new_score) -> None:
+        """Move one entry between histogram buckets; old_score is None for a new entry"""
+        if old_score == new_score:
+            return
+        ops = [UpdateOne({"board": board, "score": new_score}, {"$inc": {"users": 1}}, upsert=True)]
+        if old_score is not None:
+            ops.append(UpdateOne({"board": board, "score": old_score}, {"$inc": {"users": -1}}, upsert=True))
+        await self.db.leaderboard_scores.bulk_write(ops, ordered=False)
+        if old_score is None:
+            await self.db.leaderboard_sizes.update_one(
+                {"board": board}, {"$inc": {"entries": 1}}, upsert=True
+            )
+
+    async def _record_speed(self, user_id: str, path_id: str, now: datetime) -> None:
+        started_at = await path_started_at(self.db, user_id, path_id)
+        if started_at is None:
+            return
+        if started_at.tzinfo is None:
+            started_at = started_at.replace(tzinfo=timezone.utc)
+        days = round((now - started_at).total_seconds() / 86400, 3)
+        # Keep the best time if the path is completed again later
+        board = SPEED_PREFIX + path_id
+        previous = await self.db.leaderboard.find_one_and_update(
+            {"board": board, "user_id": user_id},
+            {"$min": {"score": days}, "$set": {"updated_at": now}},
+            upsert=True,
+            projection={"_id": 0, "score": 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+        old_days = previous.get("score") if previous else None
+        await self._move(board, old_days, days if old_days is None else min(old_days, days))
+
+
+async def top(db, board: str, limit: int) -> List[dict]:
+    """Best entries of a board with user names, best first"""
+    # Both orders walk the (board, score desc, user_id asc) index, forwards or backwards
+    if is_ascending(board):
+        order = [("score", ASCENDING), ("user_id", DESCENDING)]
+    else:
+        order = [("score", DESCENDING), ("user_id", ASCENDING)]
+    entries = await (
+        db.leaderboard.find({"board": board}, {"_id": 0, "user_id": 1, "score": 1})
+        .sort(order)
+        .limit(limit)
+        .to_list(limit)
+    )
+    names = {
+        user["id"]: user.get("name")
+        for user in await db.users.find(
+            {"id": {"$in": [e["user_id"] for e in entries]}}, {"_id": 0, "id": 1, "name": 1}
+        ).to_list(limit)
+    }
+    previous_score, rank = None, 0
+    for position, entry in enumerate(entries, start=1):
+        # Ties share a rank
+        if entry["score"] != previous_score:
+            previous_score, rank = entry["score"], position
+        entry["rank"] = rank
+        entry["user_name"] = names.get(entry["user_id"], "Anonymous")
+    return entries
+
+
+async def rank_of(db, board: str, user_id: str) -> Optional[dict]:
+    """A user's score and 1-based rank, summed over the board's score histogram"""
+    entry = await db.leaderboard.find_one({"board": board, "user_id": user_id}, {"_id": 0, "score": 1})
+    if entry is None:
+        return None
+    better = "$lt" if is_ascending(board) else "$gt"
+    ahead, size = await asyncio.gather(
+        db.leaderboard_scores.aggregate([
+            {"$match": {"board": board, "score": {better: entry["score"]}}},
+            {"$group": {"_id": None, "users": {"$sum": "$users"}}},
+        ]).to_list(1),
+        db.leaderboard_sizes.find_one({"board": board}, {"_id": 0, "entries": 1}),
+    )
+    return {
+        "board": board,
+        "user_id": user_id,
+        "score": entry["score"],
+        "rank": (ahead[0]["users"] if ahead else 0) + 1,
+        "entries": (size or {}).get("entries", 0),
+    }
+
+
+async def rebuild(db, batch_size: int = 1000) -> int:
+    """Recompute every board from user_progress, streaming in batches"""
+    boards = Leaderboards(db)
+    for collection in (db.leaderboard, db.leaderboard_scores, db.leaderboard_sizes):
+        await collection.delete_many({})
+    batch, seen = [], 0
+    async for progress in db.user_progress.find({}, {"_id": 0}).batch_size(batch_size):
+        batch.append(progress)
+        if len(batch) >= batch_size:
+            await boards.record(batch)
+            seen += len(batch)
+            batch = []
+    if batch:
+        await boards.record(batch)
+        seen += len(batch)
+    return seen
+
+
+if __name__ == "__main__":
+    import typer
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    cli = typer.Typer(help="Maintain the materialized leaderboards")
+
+    @cli.callback()
+    def main():
+        """Maintain the materialized leaderboards"""
+
+    @cli.command("rebuild")
+    def rebuild_command():
+        """Recompute every leaderboard from user_progress"""
+        db = AsyncIOMotorClient(os.environ['MONGO_URL'])[os.environ['DB_NAME']]
+        seen = asyncio.run(rebuild(db))
+        typer.echo(f"Rebuilt leaderboards from {seen} progress documents")
+
+    cli()
@@ -0,0 +1,208 @@
+# Append-only log of milestone toggles with their actual timing.
+#
+# Every accepted toggle is appended to milestone_events as
+# {user_id, path_id, milestone_id, completed, at}. Inserts are batched in
+# memory and written with insert_many. The (user_id, path_id, at) index in
+# indexes.py makes per-path timelines a cheap time-ordered scan. The
+# compaction job folds old events into one milestone_summaries document per
+# (user, path) and deletes them. Its cutoff is checkpointed in the jobs
+# collection, so a run that dies midway is resumed without folding any
+# event twice:
+#
+#     python milestone_events.py compact --older-than-days 90
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+MILESTONE_EVENT_BATCH_SIZE = int(os.environ.get("MILESTONE_EVENT_BATCH_SIZE", "500"))
+MILESTONE_EVENT_FLUSH_MS = int(os.environ.get("MILESTONE_EVENT_FLUSH_MS", "1000"))
+COMPACT_JOB_ID = "milestone_compaction"
+DUPLICATE_KEY = 11000
+
+
+class MilestoneEventLog:
+    """Buffers milestone events and appends them in batches"""
+
+    def __init__(self, db, batch_size: int = MILESTONE_EVENT_BATCH_SIZE,
+                 flush_ms: int = MILESTONE_EVENT_FLUSH_MS):
+        self.db = db
+        self.batch_size = batch_size
+        self.interval = flush_ms / 1000
+        self._pending: List[dict] = []
+        self._timer: Optional[asyncio.Task] = None
+        self.written = 0
+
+    async def record(self, user_id: str, path_id: str, changes: Dict[str, bool]) -> None:
+        at = datetime.now(timezone.utc)
+        self._pending.extend(
+            {"user_id": user_id, "path_id": path_id, "milestone_id": milestone_id,
+             "completed": completed, "at": at}
+            for milestone_id, completed in changes.items()
+        )
+        if len(self._pending) >= self.batch_size or self.interval <= 0:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self) -> None:
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            await self.db.milestone_events.insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except Exception:
+            self._pending = batch + self._pending
+            raise
+
+    async def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.interval)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to write milestone events; will retry")
+            if self._pending and self._timer is None:
+                self._timer = asyncio.create_task(self._flush_later())
+
+
+async def recent_events(db, user_id: str, path_id: str, limit: int) -> List[dict]:
+    """Newest events of one path first, from the (user_id, path_id, at) index"""
+    return await (
+        db.milestone_events.find({"user_id": user_id, "path_id": path_id}, {"_id": 0})
+        .sort("at", DESCENDING)
+        .limit(limit)
+        .to_list(limit)
+    )
+
+
+async def path_started_at(db, user_id: str, path_id: str) -> Optional[datetime]:
+    """Time of the first recorded toggle on a path, including compacted history"""
+    summary = await db.milestone_summaries.find_one(
+        {"user_id": user_id, "path_id": path_id}, {"_id": 0, "started_at": 1}
+    )
+    if summary and summary.get("started_at"):
+        return summary["started_at"]
+    first = await db.milestone_events.find_one(
+        {"user_id": user_id, "path_id": path_id}, {"_id": 0, "at": 1}, sort=[("at", ASCENDING)]
+    )
+    return first["at"] if first else None
+
+
+async def compact(db, cutoff: datetime, batch_size: int = 1000) -> int:
+    """Fold events older than cutoff into milestone_summaries, then delete them
+
+    A run that died before deleting its events is resumed with its own
+    cutoff. Summaries it already folded carry compacted_until >= that cutoff
+    and are skipped, so no event is counted twice.
+    """
+    checkpoint = await db.jobs.find_one({"_id": COMPACT_JOB_ID})
+    if checkpoint is not None and not checkpoint.get("finished_at"):
+        cutoff = checkpoint["cutoff"]
+        if cutoff.tzinfo is None:
+            cutoff = cutoff.replace(tzinfo=timezone.utc)
+        logger.info("Resuming milestone event compaction up to %s", cutoff.isoformat())
+    await db.jobs.replace_one(
+        {"_id": COMPACT_JOB_ID},
+        {"cutoff": cutoff, "started_at": datetime.now(timezone.utc), "finished_at": None},
+        upsert=True,
+    )
+
+    pipeline = [
+        {"$match": {"at": {"$lt": cutoff}}},
+        {"$sort": {"at": 1}},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "path_id": "$path_id", "milestone_id": "$milestone_id"},
+            "first_at": {"$min": "$at"},
+            "completed": {"$last": "$completed"},
+            "last_at": {"$last": "$at"},
+            "toggles": {"$sum": 1},
+        }},
+        # One summary update per (user, path), so it is applied whole or not at all
+        {"$group": {
+            "_id": {"user_id": "$_id.user_id", "path_id": "$_id.path_id"},
+            "started_at": {"$min": "$first_at"},
+            "milestones": {"$push": {
+                "id": "$_id.milestone_id",
+                "completed": "$completed",
+                "at": "$last_at",
+                "toggles": "$toggles",
+            }},
+        }},
+    ]
+    folded = 0
+    ops = []
+    async for row in db.milestone_events.aggregate(pipeline, allowDiskUse=True):
+        fields, toggles = {}, {}
+        for milestone in row["milestones"]:
+            field = f"milestones.{milestone['id']}"
+            fields[f"{field}.completed"] = milestone["completed"]
+            fields[f"{field}.at"] = milestone["at"]
+            toggles[f"{field}.toggles"] = milestone["toggles"]
+        ops.append(UpdateOne(
+            {**row["_id"], "compacted_until": {"$not": {"$gte": cutoff}}},
+            {
+                "$min": {"started_at": row["started_at"]},
+                "$set": {"compacted_until": cutoff, **fields},
+                "$inc": toggles,
+            },
+            upsert=True,
+        ))
+        if len(ops) >= batch_size:
+            folded += await _write_summaries(db, ops)
+            ops = []
+    if ops:
+        folded += await _write_summaries(db, ops)
+    await db.milestone_events.delete_many({"at": {"$lt": cutoff}})
+    await db.jobs.update_one({"_id": COMPACT_JOB_ID}, {"$set": {"finished_at": datetime.now(timezone.utc)}})
+    return folded
+
+
+async def _write_summaries(db, ops: List[UpdateOne]) -> int:
+    try:
+        result = await db.milestone_summaries.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        # A duplicate key is a summary this cutoff already folded; its
+        # filter missed and the upsert collided with the existing document
+        if any(err["code"] != DUPLICATE_KEY for err in e.details.get("writeErrors", [])):
+            raise
+        return e.details["nModified"] + e.details["nUpserted"]
+    return result.modified_count + result.upserted_count
+
+
+if __name__ == "__main__":
+    import typer
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    cli = typer.Typer(help="Maintain the milestone event log")
+
+    @cli.command("compact")
+    def compact_command(older_than_days: int = typer.Option(90, help="Fold events older than this")):
+        """Fold old milestone events into per-user summaries"""
+        db = AsyncIOMotorClient(os.environ['MONGO_URL'])[os.environ['DB_NAME']]
+        cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+        folded = asyncio.run(compact(db, cutoff))
+        typer.echo(f"Folded {folded} milestone summaries from events before {cutoff.isoformat()}")
+
+    @cli.callback()
+    def main():
+        """Maintain the milestone event log"""
+
+    cli()
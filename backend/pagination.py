@@ -0,0 +1,81 @@
+# Keyset pagination and NDJSON streaming for list endpoints.
+#
+# Pages are ordered by an indexed key that is unique within the query, and
+# the continuation token is the opaque, encoded key of the last row served.
+# Memory per request is bounded by the page size; NDJSON exports iterate the
+# Mongo cursor in batches instead of buffering the result.
+
+import base64
+import json
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+PAGE_SIZE_DEFAULT = 100
+PAGE_SIZE_MAX = 500
+STREAM_BATCH_SIZE = 200
+
+
+def encode_cursor(value) -> str:
+    raw = json.dumps({"k": str(value)}).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, parse: Callable = str):
+    """Decode a continuation token; raises ValueError when it is malformed"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        value = json.loads(base64.urlsafe_b64decode(padded))["k"]
+        return parse(value)
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise ValueError("Invalid cursor")
+
+
+def parse_object_id(value: str) -> ObjectId:
+    return ObjectId(value)
+
+
+def _projection(projection: dict, key: str) -> dict:
+    # The sort key must come back even if the caller hides it
+    return {k: v for k, v in projection.items() if k != key}
+
+
+async def fetch_page(collection, query: dict, key: str, limit: int, cursor: Optional[str],
+                     projection: dict, parse: Callable = str) -> Tuple[List[dict], Optional[str]]:
+    """One page of documents ordered by key, plus the token for the next page"""
+    if cursor:
+        query = {**query, key: {"$gt": decode_cursor(cursor, parse)}}
+    docs = await (
+        collection.find(query, _projection(projection, key))
+        .sort(key, 1)
+        .limit(limit + 1)
+        .to_list(limit + 1)
+    )
+    next_cursor = encode_cursor(docs[limit - 1][key]) if len(docs) > limit else None
+    docs = docs[:limit]
+    if projection.get(key) == 0:
+        for doc in docs:
+            doc.pop(key, None)
+    return docs, next_cursor
+
+
+def page_from_list(docs: List[dict], key: str, limit: int,
+                   cursor: Optional[str]) -> Tuple[List[dict], Optional[str]]:
+    """fetch_page over documents already in memory, with the same ordering and tokens"""
+    ordered = sorted(docs, key=lambda doc: doc[key])
+    if cursor:
+        after = decode_cursor(cursor)
+        ordered = [doc for doc in ordered if doc[key] > after]
+    next_cursor = encode_cursor(ordered[limit - 1][key]) if len(ordered) > limit else None
+    return ordered[:limit], next_cursor
+
+
+async def stream_ndjson(collection, query: dict, key: str, projection: dict,
+                        transform: Callable[[dict], dict] = lambda doc: doc,
+                        cursor: Optional[str] = None, parse: Callable = str) -> AsyncIterator[bytes]:
+    """Yield every matching document as a line of JSON, in key order"""
+    if cursor:
+        query = {**query, key: {"$gt": decode_cursor(cursor, parse)}}
+    async for doc in collection.find(query, projection).sort(key, 1).batch_size(STREAM_BATCH_SIZE):
+        yield (json.dumps(transform(doc), default=str) + "\n").encode("utf-8")
@@ -0,0 +1,207 @@
+# Atomic milestone updates for the user_progress collection.
+#
+# A toggle is a single upserting aggregation-pipeline update: the milestone
+# set is computed server-side from the document's current state, so
+# concurrent clients cannot lose each other's writes and each toggle costs
+# one round trip. Achievements are awarded afterwards by achievements.py.
+#
+# Completion is stored either as a list of milestone ids (the default) or,
+# with PROGRESS_STORAGE=bitset, as an integer mask over the milestone
+# ordinals from the catalog index. Documents are converted to the configured
+# representation on their next write, and the API always sees the list.
+# Ordinals come from the milestone "order" field, so new milestones must be
+# appended rather than inserted while bitset documents exist.
+
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+
+from bson.int64 import Int64
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from catalog import CATALOG
+
+PROGRESS_STORAGE = os.environ.get("PROGRESS_STORAGE", "list")
+
+# Mask bits are tested with $divide, which yields a double, so masks must
+# stay within the 53 bits a double represents exactly. Longer paths are
+# stored as lists.
+BITSET_MAX_MILESTONES = 53
+
+
+def uses_bitset(path_id: str) -> bool:
+    return PROGRESS_STORAGE == "bitset" and CATALOG.milestone_count[path_id] <= BITSET_MAX_MILESTONES
+
+
+def milestone_bit(milestone_id: str) -> int:
+    return 1 << CATALOG.milestone_ordinal[milestone_id]
+
+
+def encode_mask(path_id: str, milestone_ids: Iterable[str]) -> int:
+    mask = 0
+    for milestone_id in milestone_ids:
+        if CATALOG.milestone_path.get(milestone_id) == path_id:
+            mask |= milestone_bit(milestone_id)
+    return mask
+
+
+def decode_mask(path_id: str, mask: int) -> List[str]:
+    return [m for i, m in enumerate(CATALOG.milestone_ids.get(path_id, [])) if mask >> i & 1]
+
+
+def completed_milestone_ids(progress: dict) -> List[str]:
+    """Completed milestone ids of a progress document in either representation"""
+    if "completed_mask" in progress:
+        return decode_mask(progress["career_path_id"], progress["completed_mask"])
+    return progress.get("completed_milestones", [])
+
+
+def to_api(progress: dict) -> dict:
+    """Translate a stored progress document to the list representation the API exposes"""
+    if not progress or "completed_mask" not in progress:
+        return progress
+    doc = {k: v for k, v in progress.items() if k != "completed_mask"}
+    doc["completed_milestones"] = completed_milestone_ids(progress)
+    return doc
+
+
+def path_completion(path_id: str, completed_ids: List[str]) -> dict:
+    """Percent complete and next open milestone of a path, from the catalog index"""
+    total = CATALOG.milestone_count[path_id]
+    done = set(completed_ids)
+    next_milestone = next((m for m in CATALOG.milestone_ids[path_id] if m not in done), None)
+    completed_count = sum(1 for m in done if CATALOG.milestone_path.get(m) == path_id)
+    return {
+        "completed_count": completed_count,
+        "percent_complete": round(completed_count / total * 100) if total else 0,
+        "next_milestone": {
+            "id": next_milestone,
+            "title": CATALOG.milestone_by_id[next_milestone]["title"],
+        } if next_milestone else None,
+    }
+
+# ================== PIPELINE EXPRESSIONS ==================
+
+def _not_in(var: str, array) -> dict:
+    return {"$not": [{"$in": [var, array]}]}
+
+
+def _bit_is_set(mask, bit) -> dict:
+    return {"$eq": [{"$mod": [{"$floor": {"$divide": [mask, bit]}}, 2]}, 1]}
+
+
+def _stored_mask(path_id: str) -> dict:
+    """Current mask, folding a stored id list into bits if the document has one"""
+    ids = CATALOG.milestone_ids[path_id]
+    bits = [Int64(1 << i) for i in range(len(ids))]
+    from_list = {"$sum": {"$map": {
+        "input": {"$ifNull": ["$completed_milestones", []]},
+        "as": "m",
+        "in": {"$let": {
+            "vars": {"i": {"$indexOfArray": [{"$literal": ids}, "$$m"]}},
+            "in": {"$cond": [{"$gte": ["$$i", 0]}, {"$arrayElemAt": [bits, "$$i"]}, 0]},
+        }},
+    }}}
+    return {"$toLong": {"$ifNull": ["$completed_mask", from_list]}}
+
+
+def _stored_list(path_id: str) -> dict:
+    """Current id list, expanding a stored mask if the document has one"""
+    ids = CATALOG.milestone_ids[path_id]
+    from_mask = {"$filter": {
+        "input": {"$map": {
+            "input": {"$range": [0, len(ids)]},
+            "as": "i",
+            "in": {"$cond": [
+                _bit_is_set({"$ifNull": ["$completed_mask", 0]}, {"$pow": [2, "$$i"]}),
+                {"$arrayElemAt": [{"$literal": ids}, "$$i"]},
+                None,
+            ]},
+        }},
+        "as": "m",
+        "cond": {"$ne": ["$$m", None]},
+    }}
+    return {"$ifNull": ["$completed_milestones", from_mask]}
+
+
+def _list_stages(path_id: str, completed: List[str], uncompleted: List[str]) -> list:
+    current = _stored_list(path_id)
+    kept = {"$filter": {
+        "input": current,
+        "as": "m",
+        "cond": _not_in("$$m", {"$literal": uncompleted}),
+    }}
+    added = {"$filter": {
+        "input": {"$literal": completed},
+        "as": "m",
+        "cond": _not_in("$$m", current),
+    }}
+    return [
+        {"$set": {"completed_milestones": {"$concatArrays": [kept, added]}}},
+        {"$unset": "completed_mask"},
+    ]
+
+
+def _bitset_stages(path_id: str, completed: List[str], uncompleted: List[str]) -> list:
+    def fold(bits: List[int], when_set, when_clear, initial):
+        return {"$reduce": {
+            "input": [Int64(b) for b in bits],
+            "initialValue": initial,
+            "in": {"$cond": [_bit_is_set("$$value", "$$this"), when_set, when_clear]},
+        }}
+
+    keep = "$$value"
+    mask = fold([milestone_bit(m) for m in completed],
+                keep, {"$add": ["$$value", "$$this"]}, _stored_mask(path_id))
+    mask = fold([milestone_bit(m) for m in uncompleted],
+                {"$subtract": ["$$value", "$$this"]}, keep, mask)
+    return [
+        {"$set": {"completed_mask": mask}},
+        {"$unset": "completed_milestones"},
+    ]
+
+
+def progress_update_pipeline(path_id: str, completed: List[str], uncompleted: List[str]) -> list:
+    """Build the update pipeline that adds and removes milestones"""
+    bitset = uses_bitset(path_id)
+    if bitset:
+        pipeline = _bitset_stages(path_id, completed, uncompleted)
+    else:
+        pipeline = _list_stages(path_id, completed, uncompleted)
+
+    pipeline.append({"$set": {
+        "id": {"$ifNull": ["$id", str(uuid.uuid4())]},
+        "achievements": {"$ifNull": ["$achievements", []]},
+        # Bumped by every write, so consumers can order the states they see
+        "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }})
+
+    return pipeline
+
+
+def invalid_milestones(path_id: str, milestone_ids: Iterable[str]) -> List[str]:
+    """Milestone ids that do not belong to the given career path"""
+    return [m for m in milestone_ids if CATALOG.milestone_path.get(m) != path_id]
+
+
+async def apply_milestone_updates(db, user_id: str, path_id: str, completed: List[str],
+                                  uncompleted: List[str]) -> Optional[dict]:
+    """Atomically apply milestone changes and return the updated progress document"""
+    pipeline = progress_update_pipeline(path_id, completed, uncompleted)
+    query = {"user_id": user_id, "career_path_id": path_id}
+    try:
+        progress = await db.user_progress.find_one_and_update(
+            query, pipeline, upsert=True, projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # Lost an upsert race on the unique (user_id, career_path_id) index;
+        # the document exists now, so the retry is a plain update
+        progress = await db.user_progress.find_one_and_update(
+            query, pipeline, projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+    return to_api(progress)
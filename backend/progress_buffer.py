@@ -0,0 +1,175 @@
+# Opt-in write-behind buffer for milestone toggles.
+#
+# With PROGRESS_WRITE_BUFFER_MS > 0, toggles are coalesced per (user, path)
+# for that window and flushed with one unordered bulk_write of the same
+# atomic pipeline updates progress.py issues directly. Reads for a user flush
+# that user's pending toggles first (read-your-writes), and the shutdown hook
+# flushes everything. The buffer is per worker: read-your-writes holds for
+# requests served by the same worker, so keep the window short when requests
+# are not pinned to a worker.
+
+import asyncio
+import logging
+import os
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from progress import apply_milestone_updates, progress_update_pipeline
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_WRITE_BUFFER_MS = int(os.environ.get("PROGRESS_WRITE_BUFFER_MS", "0"))
+PROGRESS_WRITE_BUFFER_MAX_KEYS = int(os.environ.get("PROGRESS_WRITE_BUFFER_MAX_KEYS", "5000"))
+
+DUPLICATE_KEY = 11000
+
+Key = Tuple[str, str]
+
+
+class ProgressWriteBuffer:
+    """Coalesces milestone toggles per (user, path) and flushes them in bulk"""
+
+    def __init__(self, db, window_ms: int = PROGRESS_WRITE_BUFFER_MS,
+                 max_keys: int = PROGRESS_WRITE_BUFFER_MAX_KEYS):
+        self.db = db
+        self.window = window_ms / 1000
+        self.max_keys = max_keys
+        self._pending: Dict[Key, Dict[str, bool]] = {}
+        self._pending_paths: Dict[str, Set[str]] = {}
+        self._in_flight: Counter = Counter()
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        self._flush_listeners: List[Callable[[List[Key]], Awaitable[None]]] = []
+        self.flushes = 0
+        self.coalesced = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def add_flush_listener(self, listener: Callable[[List[Key]], Awaitable[None]]) -> None:
+        """Await listener(keys) after each successful flush with the (user, path) keys written"""
+        self._flush_listeners.append(listener)
+
+    async def toggle(self, user_id: str, path_id: str, milestone_id: str,
+                     completed: bool) -> Optional[dict]:
+        """Record a toggle; written immediately when buffering is disabled
+
+        Returns the updated progress document for immediate writes and None
+        for buffered ones.
+        """
+        if not self.enabled:
+            if completed:
+                return await apply_milestone_updates(self.db, user_id, path_id, [milestone_id], [])
+            return await apply_milestone_updates(self.db, user_id, path_id, [], [milestone_id])
+
+        changes = self._pending.setdefault((user_id, path_id), {})
+        if milestone_id in changes:
+            self.coalesced += 1
+        changes[milestone_id] = completed
+        self._pending_paths.setdefault(user_id, set()).add(path_id)
+
+        if len(self._pending) >= self.max_keys:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+        return None
+
+    async def settle(self, user_id: str) -> None:
+        """Make every buffered toggle of a user visible to the next read"""
+        if user_id in self._pending_paths or self._in_flight[user_id]:
+            await self.flush([(user_id, path_id) for path_id in self._pending_paths.get(user_id, ())])
+
+    async def flush(self, keys: Optional[Iterable[Key]] = None) -> None:
+        """Write pending toggles, all of them or only the given keys"""
+        async with self._lock:
+            batch = self._take(keys)
+            if not batch:
+                return
+            users = Counter(user_id for user_id, _ in batch)
+            self._in_flight.update(users)
+            try:
+                await self._write(batch)
+                self.flushes += 1
+            except Exception:
+                self._restore(batch)
+                raise
+            finally:
+                for user_id, count in users.items():
+                    self._in_flight[user_id] -= count
+                    if self._in_flight[user_id] <= 0:
+                        del self._in_flight[user_id]
+        for listener in self._flush_listeners:
+            try:
+                await listener(list(batch))
+            except Exception:
+                logger.exception("Progress flush listener failed")
+
+    async def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.window)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to flush buffered progress writes; will retry")
+            if self._pending and self._timer is None:
+                self._timer = asyncio.create_task(self._flush_later())
+
+    def _take(self, keys: Optional[Iterable[Key]]) -> Dict[Key, Dict[str, bool]]:
+        if keys is None:
+            batch, self._pending = self._pending, {}
+            self._pending_paths = {}
+            return batch
+        batch = {}
+        for key in keys:
+            changes = self._pending.pop(key, None)
+            if changes is None:
+                continue
+            batch[key] = changes
+            user_id, path_id = key
+            paths = self._pending_paths.get(user_id)
+            if paths is not None:
+                paths.discard(path_id)
+                if not paths:
+                    del self._pending_paths[user_id]
+        return batch
+
+    def _restore(self, batch: Dict[Key, Dict[str, bool]]) -> None:
+        # Toggles queued while the failed flush was in flight are newer and win
+        for key, changes in batch.items():
+            self._pending[key] = {**changes, **self._pending.get(key, {})}
+            self._pending_paths.setdefault(key[0], set()).add(key[1])
+
+    async def _write(self, batch: Dict[Key, Dict[str, bool]]) -> None:
+        updates = []
+        for (user_id, path_id), changes in batch.items():
+            completed = [m for m, done in changes.items() if done]
+            uncompleted = [m for m, done in changes.items() if not done]
+            updates.append((
+                {"user_id": user_id, "career_path_id": path_id},
+                progress_update_pipeline(path_id, completed, uncompleted),
+            ))
+        try:
+            await self.db.user_progress.bulk_write(
+                [UpdateOne(query, pipeline, upsert=True) for query, pipeline in updates],
+                ordered=False,
+            )
+        except BulkWriteError as e:
+            # Upserts that lost a race with another worker's insert are
+            # retried as plain updates; anything else is a real failure
+            errors = e.details.get("writeErrors", [])
+            if any(err["code"] != DUPLICATE_KEY for err in errors):
+                raise
+            await self.db.user_progress.bulk_write(
+                [UpdateOne(*updates[err["index"]]) for err in errors],
+                ordered=False,
+            )
@@ -0,0 +1,326 @@
+# Skill assessment scoring, compiled from the catalog into NumPy arrays.
+#
+# Every (question, option) pair gets a row in a flat option table. The rows
+# of the score matrix give the points each option adds to each career path.
+# The modifier vectors hold the option's time multiplier and learning style
+# (NaN / -1 when the option sets none). A set of answers is a row of option
+# indices, one per question, with a zero padding row for unanswered
+# questions. Scoring an (answer sets x questions) matrix is then one gather
+# and a sum over the question axis, whatever the number of sets.
+#
+# Submitted answers are stored on the user document as one byte per question
+# (quiz_answers), in the order of a question layout saved once in
+# quiz_layouts. The rescore job streams users in batches and scores them
+# with the current questions. It writes the changed recommendations with
+# unordered bulk writes, skipping users whose answers changed since they
+# were read, and checkpoints its position, so an interrupted run resumes
+# where it stopped:
+#
+#     python quiz.py rescore --batch-size 1000
+#
+# Options must be appended to a question, never reordered, while answers
+# are stored.
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from bson import Binary
+from pymongo import UpdateOne
+
+from catalog import CATALOG, CatalogIndex
+
+logger = logging.getLogger(__name__)
+
+OPTION_PATH_POINTS = 10
+DEFAULT_TIME_MULTIPLIER = 1.5
+DEFAULT_LEARNING_STYLE = "all"
+DEFAULT_COMPLETION_WEEKS = 24
+RECOMMENDATION_COUNT = 3
+SCORE_CHUNK_SIZE = 10000
+
+# Stored answer byte for an unanswered question
+UNANSWERED_BYTE = 255
+RESCORE_BATCH_SIZE = int(os.environ.get("QUIZ_RESCORE_BATCH_SIZE", "1000"))
+RESCORE_JOB_ID = "quiz_rescore"
+
+
+class QuizScorer:
+    """Questions compiled into a (question, option) -> path score matrix"""
+
+    def __init__(self, catalog: CatalogIndex):
+        self.path_ids: Tuple[str, ...] = tuple(catalog.path_by_id)
+        self.question_ids: Tuple[str, ...] = tuple(q["id"] for q in catalog.questions)
+        self.question_index: Dict[str, int] = {q: i for i, q in enumerate(self.question_ids)}
+        self.option_counts = np.array([len(q["options"]) for q in catalog.questions], dtype=np.int64)
+        self.option_offsets = np.concatenate(([0], np.cumsum(self.option_counts)[:-1]))
+        path_index = {p: i for i, p in enumerate(self.path_ids)}
+
+        options = [option for q in catalog.questions for option in q["options"]]
+        styles = sorted({o["preference"] for o in options if "preference" in o} | {DEFAULT_LEARNING_STYLE})
+        self.learning_styles: Tuple[str, ...] = tuple(styles)
+        # The last row is all zeros and stands for an unanswered question
+        self.unanswered = len(options)
+        self.scores = np.zeros((len(options) + 1, len(self.path_ids)), dtype=np.int64)
+        self.time_multipliers = np.full(len(options) + 1, np.nan)
+        self.style_codes = np.full(len(options) + 1, -1, dtype=np.int64)
+        for row, option in enumerate(options):
+            for path_id in option.get("paths", []):
+                # Paths missing from the catalog could never be recommended
+                if path_id in path_index:
+                    self.scores[row, path_index[path_id]] += OPTION_PATH_POINTS
+            if "time_multiplier" in option:
+                self.time_multipliers[row] = option["time_multiplier"]
+            if "preference" in option:
+                self.style_codes[row] = styles.index(option["preference"])
+
+        self.total_days = np.array([catalog.total_days[p] for p in self.path_ids], dtype=np.float64)
+        self.path_names: Tuple[str, ...] = tuple(catalog.path_by_id[p]["name"] for p in self.path_ids)
+        self.default_style = styles.index(DEFAULT_LEARNING_STYLE)
+
+        if self.option_counts.size and self.option_counts.max() >= UNANSWERED_BYTE:
+            raise ValueError("Questions with 255 or more options cannot be stored as bytes")
+        self.layout_id = _digest(self.question_ids)[:12]
+        # Changes whenever a stored answer set could score differently
+        self.version = _digest([catalog.questions, self.path_ids, self.path_names,
+                                self.total_days.tolist()])[:16]
+
+    def encode(self, answers: Iterable[Tuple[str, int]]) -> np.ndarray:
+        """Selected option per question for one answer set; -1 marks unanswered
+
+        Unknown questions are ignored and a later answer to the same question
+        wins. Raises ValueError for an option index the question does not have.
+        """
+        row = np.full(len(self.question_ids), -1, dtype=np.int64)
+        for question_id, option in answers:
+            q = self.question_index.get(question_id)
+            if q is None:
+                continue
+            if not 0 <= option < self.option_counts[q]:
+                raise ValueError(f"Invalid option {option} for question {question_id}")
+            row[q] = option
+        return row
+
+    def score(self, selections: np.ndarray) -> dict:
+        """Score an (answer sets x questions) matrix of selected options (-1 = unanswered)
+
+        Returns per-set path scores, time multipliers, learning style codes
+        and estimated weeks per path.
+        """
+        selections = np.asarray(selections, dtype=np.int64).reshape(-1, len(self.question_ids))
+        if ((selections < -1) | (selections >= self.option_counts)).any():
+            raise ValueError("Option index out of range")
+        rows = np.where(selections >= 0, self.option_offsets + selections, self.unanswered)
+
+        scores = np.zeros((len(rows), len(self.path_ids)), dtype=np.int64)
+        for start in range(0, len(rows), SCORE_CHUNK_SIZE):
+            chunk = rows[start:start + SCORE_CHUNK_SIZE]
+            scores[start:start + len(chunk)] = self.scores[chunk].sum(axis=1)
+
+        # Modifiers come from the last answered question that sets them
+        time_multiplier = _last_set(self.time_multipliers[rows], ~np.isnan(self.time_multipliers[rows]),
+                                    DEFAULT_TIME_MULTIPLIER)
+        styles = self.style_codes[rows]
+        style = _last_set(styles, styles >= 0, self.default_style).astype(np.int64)
+        weeks = (self.total_days / 7 * time_multiplier[:, None]).astype(np.int64)
+        return {"scores": scores, "time_multiplier": time_multiplier, "style": style, "weeks": weeks}
+
+    def recommendations(self, scored: dict, count: int = RECOMMENDATION_COUNT) -> List[dict]:
+        """Top paths of every scored answer set, in the submit_quiz response shape"""
+        scores, weeks = scored["scores"], scored["weeks"]
+        # Stable sort keeps catalog order among equal scores
+        top = np.argsort(-scores, axis=1, kind="stable")[:, :count]
+        results = []
+        for i, path_indexes in enumerate(top):
+            paths = [
+                {
+                    "path_id": self.path_ids[p],
+                    "path_name": self.path_names[p],
+                    "score": int(scores[i, p]),
+                    "estimated_weeks": int(weeks[i, p]),
+                    "reason": "Great fit based on your interests and learning style",
+                }
+                for p in path_indexes if scores[i, p] > 0
+            ]
+            results.append({
+                "recommended_paths": paths,
+                "learning_style": self.learning_styles[scored["style"][i]],
+                "estimated_completion_weeks": paths[0]["estimated_weeks"] if paths else DEFAULT_COMPLETION_WEEKS,
+            })
+        return results
+
+    def pack(self, selections: np.ndarray) -> Binary:
+        """One answer set as stored bytes, in this scorer's question layout"""
+        return Binary(np.where(selections >= 0, selections, UNANSWERED_BYTE).astype(np.uint8).tobytes())
+
+    def unpack(self, packed: List[bytes], layout: Tuple[str, ...]) -> np.ndarray:
+        """Stored answer sets of one layout as a selections matrix for the current questions
+
+        Questions missing from the layout, and options that no longer exist,
+        count as unanswered.
+        """
+        stored = np.frombuffer(b"".join(packed), dtype=np.uint8).reshape(len(packed), len(layout))
+        stored = stored.astype(np.int64)
+        stored[stored == UNANSWERED_BYTE] = -1
+        position = {q: i for i, q in enumerate(layout)}
+        columns = np.array([position.get(q, -1) for q in self.question_ids], dtype=np.int64)
+        selections = np.where(columns >= 0, stored[:, np.maximum(columns, 0)], -1)
+        selections[selections >= self.option_counts] = -1
+        return selections
+
+    def stored_fields(self, result: dict, selections: np.ndarray) -> dict:
+        """User document fields for a scored answer set"""
+        return {
+            "recommended_paths": [p["path_id"] for p in result["recommended_paths"]],
+            "learning_style": result["learning_style"],
+            "quiz_answers": self.pack(selections),
+            "quiz_layout": self.layout_id,
+            "quiz_version": self.version,
+        }
+
+
+def _last_set(values: np.ndarray, is_set: np.ndarray, default) -> np.ndarray:
+    """Per row, the last value along axis 1 where is_set holds, else default"""
+    last = is_set.shape[1] - 1 - np.argmax(is_set[:, ::-1], axis=1)
+    picked = values[np.arange(len(values)), last]
+    return np.where(is_set.any(axis=1), picked, default)
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+QUIZ = QuizScorer(CATALOG)
+
+
+async def save_layout(db, scorer: QuizScorer = QUIZ) -> None:
+    """Record the question order of stored answers; idempotent"""
+    await db.quiz_layouts.update_one(
+        {"_id": scorer.layout_id},
+        {"$setOnInsert": {"question_ids": list(scorer.question_ids),
+                          "created_at": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+
+
+async def rescore(db, batch_size: int = RESCORE_BATCH_SIZE, restart: bool = False,
+                  report: Optional[Callable[[int], None]] = None, scorer: QuizScorer = QUIZ) -> dict:
+    """Recompute stale recommendations of every user with stored answers
+
+    Users are read in "id" order after the checkpoint of an unfinished run
+    for the same scoring version. The checkpoint is saved after every batch.
+    report(n) is called with the number of users scanned in each batch.
+    """
+    await save_layout(db, scorer)
+    layouts = {
+        layout["_id"]: tuple(layout["question_ids"])
+        async for layout in db.quiz_layouts.find({})
+    }
+    checkpoint = await db.jobs.find_one({"_id": RESCORE_JOB_ID})
+    resume = (
+        not restart and checkpoint is not None and not checkpoint.get("finished_at")
+        and checkpoint.get("version") == scorer.version
+    )
+    state = {
+        "version": scorer.version,
+        "last_id": checkpoint["last_id"] if resume else None,
+        "scanned": checkpoint["scanned"] if resume else 0,
+        "updated": checkpoint["updated"] if resume else 0,
+        "started_at": checkpoint["started_at"] if resume else datetime.now(timezone.utc),
+        "finished_at": None,
+    }
+    if resume:
+        logger.info("Resuming quiz rescore after user %s", state["last_id"])
+
+    query = {"quiz_answers": {"$exists": True}, "quiz_version": {"$ne": scorer.version}}
+    while True:
+        page = dict(query)
+        if state["last_id"] is not None:
+            page["id"] = {"$gt": state["last_id"]}
+        users = await (
+            db.users.find(page, {"_id": 0, "id": 1, "quiz_answers": 1, "quiz_layout": 1,
+                                 "recommended_paths": 1, "learning_style": 1})
+            .sort("id", 1)
+            .limit(batch_size)
+            .to_list(batch_size)
+        )
+        if not users:
+            break
+        state["updated"] += await _rescore_batch(db, users, layouts, scorer)
+        state["scanned"] += len(users)
+        state["last_id"] = users[-1]["id"]
+        await db.jobs.replace_one({"_id": RESCORE_JOB_ID}, state, upsert=True)
+        if report:
+            report(len(users))
+
+    state["finished_at"] = datetime.now(timezone.utc)
+    await db.jobs.replace_one({"_id": RESCORE_JOB_ID}, state, upsert=True)
+    return state
+
+
+async def _rescore_batch(db, users: List[dict], layouts: Dict[str, tuple], scorer: QuizScorer) -> int:
+    """Score one batch and write it back; returns the number of changed recommendations"""
+    by_layout: Dict[str, List[dict]] = {}
+    for user in users:
+        by_layout.setdefault(user.get("quiz_layout"), []).append(user)
+    ops, changed = [], 0
+    for layout_id, group in by_layout.items():
+        layout = layouts.get(layout_id)
+        if layout is None:
+            logger.warning("Skipping %d users with unknown quiz layout %s", len(group), layout_id)
+            continue
+        selections = scorer.unpack([bytes(u["quiz_answers"]) for u in group], layout)
+        results = scorer.recommendations(scorer.score(selections))
+        for user, result, row in zip(group, results, selections):
+            fields = scorer.stored_fields(result, row)
+            if (fields["recommended_paths"] != user.get("recommended_paths")
+                    or fields["learning_style"] != user.get("learning_style")):
+                changed += 1
+            # Answers are rewritten in the current layout either way. Matching
+            # the answers read skips users who resubmitted in the meantime.
+            ops.append(UpdateOne(
+                {"id": user["id"], "quiz_answers": user["quiz_answers"], "quiz_layout": layout_id},
+                {"$set": fields}
+            ))
+    if ops:
+        await db.users.bulk_write(ops, ordered=False)
+    return changed
+
+
+if __name__ == "__main__":
+    import typer
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    cli = typer.Typer(help="Quiz scoring jobs")
+
+    @cli.callback()
+    def main():
+        """Quiz scoring jobs"""
+
+    @cli.command("rescore")
+    def rescore_command(
+        batch_size: int = typer.Option(RESCORE_BATCH_SIZE, help="Users per batch"),
+        restart: bool = typer.Option(False, help="Ignore the checkpoint of an unfinished run"),
+    ):
+        """Recompute stored recommendations after quiz or catalog changes"""
+        db = AsyncIOMotorClient(os.environ['MONGO_URL'])[os.environ['DB_NAME']]
+
+        async def run():
+            total = await db.users.count_documents(
+                {"quiz_answers": {"$exists": True}, "quiz_version": {"$ne": QUIZ.version}}
+            )
+            with typer.progressbar(length=total, label="Rescoring") as progress:
+                return await rescore(db, batch_size, restart, report=progress.update)
+
+        state = asyncio.run(run())
+        typer.echo(f"Scanned {state['scanned']} users, {state['updated']} recommendations changed")
+
+    cli()
@@ -0,0 +1,135 @@
+# In-memory admission control for the password endpoints.
+#
+# Token buckets are kept per key (client IP, login email) and spread over
+# shards by key hash. Each shard is a bounded LRU, so a flood of distinct
+# keys evicts idle buckets instead of growing memory. A bucket refills
+# continuously and is only updated when its key is seen. InFlightLimit caps
+# concurrent password verifications and never queues. Both reject before
+# any bcrypt work is done. State is per worker, so the effective limits
+# scale with the number of workers.
+
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+
+LOGIN_IP_PER_MINUTE = float(os.environ.get("LOGIN_IP_PER_MINUTE", "30"))
+LOGIN_IP_BURST = int(os.environ.get("LOGIN_IP_BURST", "10"))
+LOGIN_EMAIL_PER_MINUTE = float(os.environ.get("LOGIN_EMAIL_PER_MINUTE", "5"))
+LOGIN_EMAIL_BURST = int(os.environ.get("LOGIN_EMAIL_BURST", "5"))
+LOGIN_MAX_IN_FLIGHT = int(os.environ.get("LOGIN_MAX_IN_FLIGHT", "16"))
+RATE_LIMIT_SHARDS = 16
+RATE_LIMIT_KEYS_PER_SHARD = int(os.environ.get("RATE_LIMIT_KEYS_PER_SHARD", "10000"))
+# Only trust X-Forwarded-For behind a proxy that sets it
+TRUST_PROXY_HEADERS = os.environ.get("TRUST_PROXY_HEADERS", "false").lower() == "true"
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets in LRU-bounded shards"""
+
+    def __init__(self, name: str, per_minute: float, burst: int,
+                 shards: int = RATE_LIMIT_SHARDS, keys_per_shard: int = RATE_LIMIT_KEYS_PER_SHARD):
+        self.name = name
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.keys_per_shard = keys_per_shard
+        self._shards: List["OrderedDict[str, Tuple[float, float]]"] = [OrderedDict() for _ in range(shards)]
+        self.allowed = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    def _shard(self, key: str) -> "OrderedDict[str, Tuple[float, float]]":
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+        return self._shards[int.from_bytes(digest, "big") % len(self._shards)]
+
+    def acquire(self, key: str) -> Optional[float]:
+        """Take a token; returns None when allowed, else seconds until one is available"""
+        shard = self._shard(key)
+        now = time.monotonic()
+        tokens, updated = shard.get(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            shard[key] = (tokens, now)
+            shard.move_to_end(key)
+            self.rejected += 1
+            return (1 - tokens) / self.rate if self.rate > 0 else 60.0
+        shard[key] = (tokens - 1, now)
+        shard.move_to_end(key)
+        while len(shard) > self.keys_per_shard:
+            shard.popitem(last=False)
+            self.evictions += 1
+        self.allowed += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "keys": sum(len(s) for s in self._shards),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "evictions": self.evictions,
+        }
+
+
+class InFlightLimit:
+    """Caps concurrent operations; callers over the cap are turned away, not queued"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self.rejected = 0
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            raise too_many_requests(1.0)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {"name": self.name, "limit": self.limit, "in_flight": self.in_flight, "rejected": self.rejected}
+
+
+def too_many_requests(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many attempts, try again later",
+        headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+    )
+
+
+def client_ip(request: Request) -> str:
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+login_ip_limiter = TokenBucketLimiter("login_ip", LOGIN_IP_PER_MINUTE, LOGIN_IP_BURST)
+login_email_limiter = TokenBucketLimiter("login_email", LOGIN_EMAIL_PER_MINUTE, LOGIN_EMAIL_BURST)
+password_verifications = InFlightLimit("password_verifications", LOGIN_MAX_IN_FLIGHT)
+
+
+def check_login_rate(request: Request, email: Optional[str] = None) -> None:
+    """Raise 429 when the client IP or the email is over its login budget"""
+    checks = [(login_ip_limiter, client_ip(request))]
+    if email:
+        checks.append((login_email_limiter, email.strip().lower()))
+    for limiter, key in checks:
+        retry_after = limiter.acquire(key)
+        if retry_after is not None:
+            raise too_many_requests(retry_after)
+
+
+def rate_limit_stats() -> List[dict]:
+    return [login_ip_limiter.stats(), login_email_limiter.stats(), password_verifications.stats()]
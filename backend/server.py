@@ -1,26 +1,67 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, status
 from fastapi.security import HTTPAuthorizationCredentials
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+import asyncio
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict
+from typing import List, Literal, Optional, Dict, Set
 import uuid
 from datetime import datetime, timezone
 from auth import (
-    get_password_hash,
-    verify_password,
+    get_password_hash_async,
+    verify_password_async,
+    password_needs_rehash,
+    password_pool,
     create_access_token,
+    create_stream_ticket,
+    get_admin_user,
     get_current_user,
     get_current_user_optional,
-    security
+    redeem_stream_ticket,
+    revoke_token,
+    security,
+    sync_revocations,
+    token_cache,
+    token_denylist,
+    STREAM_TICKET_SECONDS
 )
-from enhanced_data import ENHANCED_CAREER_PATHS, SKILL_ASSESSMENT_QUESTIONS
-import base64
-from io import BytesIO
+from catalog import CATALOG, CATALOG_VIEWS, CareerPath, career_paths_adapter, resolve_projection
+from http_cache import PROFILE_CACHE_CONTROL, RenderedBody, render_json, cached_json_response, etag_matches
+from progress import (
+    apply_milestone_updates,
+    completed_milestone_ids,
+    invalid_milestones,
+    path_completion,
+    to_api
+)
+from indexes import ensure_indexes
+from progress_buffer import ProgressWriteBuffer
+from events import ProgressEventHub, milestone_event, progress_event
+from pagination import (
+    PAGE_SIZE_DEFAULT,
+    PAGE_SIZE_MAX,
+    decode_cursor,
+    fetch_page,
+    page_from_list,
+    parse_object_id,
+    stream_ndjson
+)
+from cache import TTLCache
+from milestone_events import MilestoneEventLog, recent_events
+from leaderboard import GLOBAL_BOARD, Leaderboards, board_name, rank_of, top
+from analytics import load_funnels
+from achievements import AchievementEngine, ProgressChange, user_achievements
+from quiz import QUIZ, save_layout
+from certificates import ARTIFACT_CACHE_CONTROL, MEDIA_TYPES, CertificateRenderer, available_formats
+from ratelimit import check_login_rate, password_verifications, rate_limit_stats
+import numpy as np
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -29,6 +70,80 @@ load_dotenv(ROOT_DIR / '.env')
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
+progress_writes = ProgressWriteBuffer(db)
+progress_events = ProgressEventHub()
+milestone_log = MilestoneEventLog(db)
+leaderboards = Leaderboards(db)
+achievement_engine = AchievementEngine(db)
+certificate_renderer = CertificateRenderer(db)
+
+async def _after_buffered_flush(keys: List[tuple]) -> None:
+    # Buffered flushes do not return documents; read the flushed ones back once
+    flushed = await db.user_progress.find(
+        {"$or": [{"user_id": user_id, "career_path_id": path_id} for user_id, path_id in keys]},
+        {"_id": 0}
+    ).to_list(None)
+    leaderboards.schedule(flushed)
+    # Which toggles completed milestones is not known here; the rules are idempotent
+    for progress in flushed:
+        await evaluate_achievements(ProgressChange(progress))
+
+async def evaluate_achievements(change: ProgressChange) -> List[str]:
+    """Run the achievement engine and drop cached copies of what it wrote"""
+    unlocked = await achievement_engine.process(change)
+    if unlocked:
+        user_id = change.progress["user_id"]
+        progress_cache.invalidate(user_id)
+        profile_cache.invalidate(user_id)
+    return unlocked
+
+progress_writes.add_flush_listener(_after_buffered_flush)
+
+# Per-user progress documents, read through and invalidated on every write.
+# Writes from other workers only invalidate through change-stream events, so
+# the cache is bypassed while no change stream is active (a standalone
+# mongod has none). PROGRESS_CACHE_TTL_SECONDS bounds how long an entry can
+# outlive a missed event; 0 disables the cache.
+progress_cache = TTLCache(
+    max_size=int(os.environ.get("PROGRESS_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("PROGRESS_CACHE_TTL_SECONDS", "30")),
+    name="user_progress"
+)
+progress_events.add_listener(progress_cache.invalidate)
+
+# Rendered /auth/me bodies per user. Writes to the user document in this
+# worker invalidate them; writes from other workers or jobs show up within
+# the TTL.
+profile_cache = TTLCache(
+    max_size=int(os.environ.get("PROFILE_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("PROFILE_CACHE_TTL_SECONDS", "60")),
+    name="user_profiles"
+)
+
+async def load_profile(user_id: str) -> Optional[RenderedBody]:
+    async def load():
+        user = await db.users.find_one({"id": user_id}, USER_PROFILE_PROJECTION)
+        return render_json(jsonable_encoder(user)) if user else None
+    return await profile_cache.get_or_load(user_id, load)
+
+async def load_user_progress(user_id: str) -> List[dict]:
+    """All progress documents of a user, in storage form; callers must not mutate them"""
+    await progress_writes.settle(user_id)
+    # One document per (user, path), so this is bounded by the catalog size
+    def load():
+        return db.user_progress.find({"user_id": user_id}, {"_id": 0}).to_list(None)
+    if not progress_events.change_stream_active:
+        # Entries cached before the stream stopped may have missed events
+        progress_cache.clear()
+        return await load()
+    return await progress_cache.get_or_load(user_id, load)
+
+async def load_path_progress(user_id: str, path_id: str) -> Optional[dict]:
+    progress_list = await load_user_progress(user_id)
+    return next((p for p in progress_list if p["career_path_id"] == path_id), None)
+
+# Internal fields never returned to clients
+USER_PROFILE_PROJECTION = {"_id": 0, "hashed_password": 0, "quiz_answers": 0, "quiz_layout": 0, "quiz_version": 0}
 
 # Create the main app
 app = FastAPI()
@@ -36,28 +151,7 @@ api_router = APIRouter(prefix="/api")
 
 # ================== MODELS ==================
 
-class Resource(BaseModel):
-    title: str
-    url: str
-    type: str  # video, article, course
-
-class Milestone(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    title: str
-    description: str
-    order: int
-    resources: List[Resource]
-    estimated_days: int
-
-class CareerPath(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    name: str
-    description: str
-    icon: str
-    color: str
-    milestones: List[Milestone]
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+QUIZ_BATCH_MAX = 10000
 
 class UserProgress(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -72,6 +166,9 @@ class ProgressUpdate(BaseModel):
     milestone_id: str
     completed: bool
 
+class ProgressBatchUpdate(BaseModel):
+    updates: List[ProgressUpdate]
+
 # Auth Models
 class UserSignup(BaseModel):
     email: EmailStr
@@ -100,6 +197,9 @@ class QuizAnswer(BaseModel):
 class QuizSubmission(BaseModel):
     answers: List[QuizAnswer]
 
+class QuizBatchScore(BaseModel):
+    answer_sets: List[List[QuizAnswer]] = Field(max_length=QUIZ_BATCH_MAX)
+
 class QuizResult(BaseModel):
     recommended_paths: List[dict]
     learning_style: str
@@ -117,15 +217,17 @@ class ShareProgress(BaseModel):
 
 # --- Auth Routes ---
 @api_router.post("/auth/signup")
-async def signup(user_data: UserSignup):
+async def signup(user_data: UserSignup, request: Request):
     """Register a new user"""
+    check_login_rate(request)
     # Check if user exists
     existing_user = await db.users.find_one({"email": user_data.email})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create new user
-    hashed_password = get_password_hash(user_data.password)
+    with password_verifications.slot():
+        hashed_password = await get_password_hash_async(user_data.password)
     new_user = {
         "id": str(uuid.uuid4()),
         "email": user_data.email,
@@ -136,7 +238,11 @@ async def signup(user_data: UserSignup):
         "recommended_paths": []
     }
     
-    await db.users.insert_one(new_user)
+    try:
+        await db.users.insert_one(new_user)
+    except DuplicateKeyError:
+        # Another signup for the same email won the race past the check above
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create access token
     access_token = create_access_token(data={"sub": new_user["id"], "email": new_user["email"]})
@@ -152,15 +258,27 @@ async def signup(user_data: UserSignup):
     }
 
 @api_router.post("/auth/login")
-async def login(credentials: UserLogin):
+async def login(credentials: UserLogin, request: Request):
     """Login user"""
+    # Rejected before the lookup and before any bcrypt work
+    check_login_rate(request, credentials.email)
     user = await db.users.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user["hashed_password"]):
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password"
+        )
+    with password_verifications.slot():
+        verified = await verify_password_async(credentials.password, user["hashed_password"])
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
         )
     
+    if password_needs_rehash(user["hashed_password"]):
+        _schedule_rehash(user["id"], user["hashed_password"], credentials.password)
+    
     # Create access token
     access_token = create_access_token(data={"sub": user["id"], "email": user["email"]})
     
@@ -176,37 +294,124 @@ async def login(credentials: UserLogin):
         }
     }
 
+# Hashes with an outdated cost are replaced after login, off the response path
+rehash_tasks: Set[asyncio.Task] = set()
+rehash_stats = {"rehashed": 0, "failed": 0}
+
+def _schedule_rehash(user_id: str, old_hash: str, password: str) -> None:
+    task = asyncio.create_task(_rehash_password(user_id, old_hash, password))
+    rehash_tasks.add(task)
+    task.add_done_callback(rehash_tasks.discard)
+
+async def _rehash_password(user_id: str, old_hash: str, password: str) -> None:
+    try:
+        new_hash = await get_password_hash_async(password)
+        # Only replace the hash that was verified, so a concurrent password change wins
+        result = await db.users.update_one(
+            {"id": user_id, "hashed_password": old_hash},
+            {"$set": {"hashed_password": new_hash}}
+        )
+        rehash_stats["rehashed"] += result.modified_count
+    except Exception:
+        # The pool may be saturated; the next login tries again
+        rehash_stats["failed"] += 1
+        logger.warning("Password rehash failed for user %s", user_id, exc_info=True)
+
+@api_router.post("/auth/logout")
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Revoke the current token on every worker"""
+    record = revoke_token(credentials.credentials)
+    await db.revoked_tokens.update_one({"key": record["key"]}, {"$setOnInsert": record}, upsert=True)
+    return {"success": True}
+
 @api_router.get("/auth/me")
-async def get_me(current_user: dict = Depends(get_current_user)):
+async def get_me(request: Request, current_user: dict = Depends(get_current_user)):
     """Get current user info"""
-    user = await db.users.find_one({"id": current_user["user_id"]}, {"_id": 0, "hashed_password": 0})
-    if not user:
+    rendered = await load_profile(current_user["user_id"])
+    if rendered is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    return cached_json_response(request, rendered, PROFILE_CACHE_CONTROL)
 
 # --- Career Paths Routes ---
 @api_router.get("/")
 async def root():
     return {"message": "SUPERCHARGE API - Enhanced Career Roadmap Platform"}
 
+def _catalog_projection(fields: Optional[str], view: Optional[str]) -> Optional[tuple]:
+    try:
+        return resolve_projection(fields, view)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @api_router.get("/career-paths", response_model=List[CareerPath])
-async def get_career_paths():
-    """Get all career paths with enhanced data"""
-    return ENHANCED_CAREER_PATHS
+async def get_career_paths(request: Request, fields: Optional[str] = None, view: Optional[str] = None):
+    """Get all career paths with enhanced data, optionally projected with ?fields= or ?view=summary"""
+    projection = _catalog_projection(fields, view)
+    if projection is None:
+        rendered = CATALOG.rendered(
+            "career-paths",
+            lambda: RenderedBody(career_paths_adapter.dump_json(CATALOG.snapshot))
+        )
+    else:
+        rendered = CATALOG.rendered(
+            ("career-paths", projection),
+            lambda: render_json([CATALOG.project(p["id"], projection) for p in CATALOG.paths])
+        )
+    return cached_json_response(request, rendered)
 
 @api_router.get("/career-paths/{path_id}", response_model=CareerPath)
-async def get_career_path(path_id: str):
-    """Get a specific career path"""
-    for path in ENHANCED_CAREER_PATHS:
-        if path["id"] == path_id:
-            return path
-    raise HTTPException(status_code=404, detail="Career path not found")
+async def get_career_path(path_id: str, request: Request, fields: Optional[str] = None,
+                          view: Optional[str] = None):
+    """Get a specific career path, optionally projected with ?fields= or ?view=summary"""
+    path = CATALOG.snapshot_by_id.get(path_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Career path not found")
+    projection = _catalog_projection(fields, view)
+    if projection is None:
+        rendered = CATALOG.rendered(
+            ("career-path", path_id),
+            lambda: RenderedBody(path.model_dump_json().encode("utf-8"))
+        )
+    else:
+        rendered = CATALOG.rendered(
+            ("career-path", path_id, projection),
+            lambda: render_json(CATALOG.project(path_id, projection))
+        )
+    return cached_json_response(request, rendered)
 
 # --- Progress Routes ---
+def _check_cursor(cursor: Optional[str], parse=str) -> None:
+    if cursor:
+        try:
+            decode_cursor(cursor, parse)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+def _ndjson_response(lines) -> StreamingResponse:
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
 @api_router.get("/progress/{user_id}", response_model=List[UserProgress])
-async def get_user_progress(user_id: str):
-    """Get user's progress across all career paths"""
-    progress_list = await db.user_progress.find({"user_id": user_id}, {"_id": 0}).to_list(100)
+async def get_user_progress(
+    user_id: str,
+    response: Response,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json"
+):
+    """Get user's progress across all career paths, one page at a time (X-Next-Cursor) or as NDJSON"""
+    _check_cursor(cursor)
+    if format == "ndjson":
+        await progress_writes.settle(user_id)
+        return _ndjson_response(stream_ndjson(
+            db.user_progress, {"user_id": user_id}, "career_path_id", {"_id": 0}, to_api, cursor
+        ))
+    
+    progress_list, next_cursor = page_from_list(
+        await load_user_progress(user_id), "career_path_id", limit, cursor
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    progress_list = [dict(to_api(p)) for p in progress_list]
     
     for progress in progress_list:
         if isinstance(progress.get('updated_at'), str):
@@ -217,10 +422,7 @@ async def get_user_progress(user_id: str):
 @api_router.get("/progress/{user_id}/{path_id}")
 async def get_path_progress(user_id: str, path_id: str):
     """Get user's progress for a specific career path"""
-    progress = await db.user_progress.find_one(
-        {"user_id": user_id, "career_path_id": path_id},
-        {"_id": 0}
-    )
+    progress = await load_path_progress(user_id, path_id)
     
     if not progress:
         # Return empty progress if none exists
@@ -232,6 +434,7 @@ async def get_path_progress(user_id: str, path_id: str):
             "updated_at": datetime.now(timezone.utc).isoformat()
         }
     
+    progress = dict(to_api(progress))
     if isinstance(progress.get('updated_at'), str):
         progress['updated_at'] = datetime.fromisoformat(progress['updated_at'])
     
@@ -240,148 +443,176 @@ async def get_path_progress(user_id: str, path_id: str):
 @api_router.post("/progress/{user_id}/{path_id}")
 async def update_progress(user_id: str, path_id: str, update: ProgressUpdate):
     """Update milestone completion status with achievement tracking"""
-    # Find existing progress
-    existing = await db.user_progress.find_one(
-        {"user_id": user_id, "career_path_id": path_id}
-    )
+    if not CATALOG.get_path(path_id):
+        raise HTTPException(status_code=404, detail="Career path not found")
+    if invalid_milestones(path_id, [update.milestone_id]):
+        raise HTTPException(status_code=400, detail="Milestone does not belong to this career path")
+    
+    # Single atomic upsert, possibly coalesced with other toggles by the
+    # write buffer, whose flush listener evaluates achievements instead
+    progress = await progress_writes.toggle(user_id, path_id, update.milestone_id, update.completed)
+    await milestone_log.record(user_id, path_id, {update.milestone_id: update.completed})
+    if progress:
+        await evaluate_achievements(ProgressChange(progress, completed=update.completed))
+    leaderboards.schedule([progress])
+    progress_cache.invalidate(user_id)
+    progress_events.publish(user_id, milestone_event(path_id, update.milestone_id, update.completed))
     
-    # Get career path to check milestones
-    career_path = next((p for p in ENHANCED_CAREER_PATHS if p["id"] == path_id), None)
-    if not career_path:
+    return {
+        "success": True,
+        "milestone_id": update.milestone_id,
+        "completed": update.completed
+    }
+
+@api_router.post("/progress/{user_id}/{path_id}/batch")
+async def update_progress_batch(user_id: str, path_id: str, batch: ProgressBatchUpdate):
+    """Apply several milestone changes in one atomic update"""
+    if not CATALOG.get_path(path_id):
         raise HTTPException(status_code=404, detail="Career path not found")
+    if not batch.updates:
+        raise HTTPException(status_code=400, detail="No milestone updates given")
     
-    if existing:
-        completed = existing.get("completed_milestones", [])
-        achievements = existing.get("achievements", [])
-        
-        if update.completed and update.milestone_id not in completed:
-            completed.append(update.milestone_id)
-            
-            # Check for achievements
-            milestone_count = len(completed)
-            total_milestones = len(career_path["milestones"])
-            
-            # First milestone achievement
-            if milestone_count == 1 and "first_step" not in achievements:
-                achievements.append("first_step")
-            
-            # Halfway achievement
-            if milestone_count >= total_milestones / 2 and "halfway_hero" not in achievements:
-                achievements.append("halfway_hero")
-            
-            # Completion achievement
-            if milestone_count == total_milestones and "path_master" not in achievements:
-                achievements.append("path_master")
-            
-            # Speed achievements (if completed in estimated time or less)
-            # This is simplified - in production you'd track actual time
-            
-        elif not update.completed and update.milestone_id in completed:
-            completed.remove(update.milestone_id)
-        
-        await db.user_progress.update_one(
-            {"user_id": user_id, "career_path_id": path_id},
-            {
-                "$set": {
-                    "completed_milestones": completed,
-                    "achievements": achievements,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
-            }
+    # Later entries for the same milestone win
+    final_state = {u.milestone_id: u.completed for u in batch.updates}
+    invalid = invalid_milestones(path_id, final_state)
+    if invalid:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Milestones do not belong to this career path: {', '.join(invalid)}"
         )
-    else:
-        # Create new progress entry
-        achievements = []
-        completed_list = [update.milestone_id] if update.completed else []
-        
-        if update.completed:
-            achievements.append("first_step")
-        
-        new_progress = {
-            "id": str(uuid.uuid4()),
-            "user_id": user_id,
-            "career_path_id": path_id,
-            "completed_milestones": completed_list,
-            "achievements": achievements,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.user_progress.insert_one(new_progress)
+    
+    completed = [m for m, done in final_state.items() if done]
+    uncompleted = [m for m, done in final_state.items() if not done]
+    await progress_writes.settle(user_id)
+    progress = await apply_milestone_updates(db, user_id, path_id, completed, uncompleted)
+    await milestone_log.record(user_id, path_id, final_state)
+    await evaluate_achievements(ProgressChange(progress, completed=bool(completed)))
+    leaderboards.schedule([progress])
+    progress_cache.invalidate(user_id)
+    progress_events.publish(user_id, progress_event(progress))
     
     return {
         "success": True,
-        "milestone_id": update.milestone_id,
-        "completed": update.completed
+        "completed_milestones": progress.get("completed_milestones", []),
+        "achievements": progress.get("achievements", [])
     }
 
+@api_router.post("/stream/ticket")
+async def create_progress_stream_ticket(current_user: dict = Depends(get_current_user)):
+    """Short-lived ticket that opens the progress stream"""
+    return {"ticket": create_stream_ticket(current_user["user_id"]), "expires_in": STREAM_TICKET_SECONDS}
+
+@api_router.get("/stream/progress")
+async def stream_progress(request: Request, ticket: Optional[str] = None):
+    """Server-sent events with the current user's progress changes"""
+    # EventSource cannot set headers, so browsers pass a stream ticket instead
+    authorization = request.headers.get("authorization", "")
+    if ticket is not None:
+        user_id = redeem_stream_ticket(ticket)
+    elif authorization.lower().startswith("bearer "):
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=authorization[7:])
+        user_id = (await get_current_user(credentials))["user_id"]
+    else:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+
+    return StreamingResponse(
+        progress_events.stream(user_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/progress/{user_id}/{path_id}/history")
+async def get_progress_history(user_id: str, path_id: str, limit: int = Query(50, ge=1, le=PAGE_SIZE_MAX)):
+    """Most recent milestone toggles on a path, newest first"""
+    await milestone_log.flush()
+    return {"user_id": user_id, "path_id": path_id, "events": await recent_events(db, user_id, path_id, limit)}
+
+# --- Dashboard Routes ---
+@api_router.get("/dashboard")
+async def get_dashboard(current_user: dict = Depends(get_current_user)):
+    """Catalog summary, per-path progress and achievements for the current user in one response"""
+    user_id = current_user["user_id"]
+    progress_list = await load_user_progress(user_id)
+    progress_by_path = {p["career_path_id"]: to_api(p) for p in progress_list}
+    achievements = await user_achievements(db, user_id)
+    
+    paths = []
+    for path_id in CATALOG.path_by_id:
+        progress = progress_by_path.get(path_id)
+        completed = progress.get("completed_milestones", []) if progress else []
+        paths.append({
+            **CATALOG.project(path_id, CATALOG_VIEWS["summary"]),
+            "started": progress is not None and bool(completed),
+            "completed_milestones": completed,
+            **path_completion(path_id, completed)
+        })
+    
+    tracked = [p for p in paths if p["id"] in progress_by_path]
+    return {
+        "user_id": user_id,
+        "paths": paths,
+        "achievements": achievements,
+        "stats": {
+            "paths_completed": sum(1 for p in paths if p["percent_complete"] == 100),
+            "milestones_completed": sum(p["completed_count"] for p in paths),
+            "average_progress": round(sum(p["percent_complete"] for p in tracked) / len(tracked)) if tracked else 0
+        }
+    }
+
+# --- Leaderboard Routes ---
+def _leaderboard(board: str, metric: str) -> str:
+    if board != GLOBAL_BOARD and not CATALOG.get_path(board):
+        raise HTTPException(status_code=404, detail="Career path not found")
+    if metric == "speed" and board == GLOBAL_BOARD:
+        raise HTTPException(status_code=400, detail="Speed rankings are per career path")
+    return board_name(board, metric)
+
+@api_router.get("/leaderboard/{board}")
+async def get_leaderboard(
+    board: str,
+    metric: Literal["milestones", "speed"] = "milestones",
+    limit: int = Query(10, ge=1, le=100)
+):
+    """Top users of a career path, or "global", by completed milestones or completion speed"""
+    name = _leaderboard(board, metric)
+    return {"board": board, "metric": metric, "entries": await top(db, name, limit)}
+
+@api_router.get("/leaderboard/{board}/rank/{user_id}")
+async def get_leaderboard_rank(
+    board: str,
+    user_id: str,
+    metric: Literal["milestones", "speed"] = "milestones"
+):
+    """A user's rank on a leaderboard"""
+    rank = await rank_of(db, _leaderboard(board, metric), user_id)
+    if rank is None:
+        raise HTTPException(status_code=404, detail="User is not on this leaderboard")
+    return {**rank, "board": board, "metric": metric}
+
 # --- Quiz Routes ---
 @api_router.get("/quiz/questions")
-async def get_quiz_questions():
+async def get_quiz_questions(request: Request):
     """Get skill assessment quiz questions"""
-    return SKILL_ASSESSMENT_QUESTIONS
+    rendered = CATALOG.rendered("quiz-questions", lambda: render_json(CATALOG.questions))
+    return cached_json_response(request, rendered)
 
 @api_router.post("/quiz/submit")
 async def submit_quiz(submission: QuizSubmission, current_user: dict = Depends(get_current_user)):
     """Submit quiz and get personalized recommendations"""
-    # Calculate scores for each path
-    path_scores = {}
-    learning_style = "all"
-    time_multiplier = 1.5
-    
-    for answer in submission.answers:
-        question = next((q for q in SKILL_ASSESSMENT_QUESTIONS if q["id"] == answer.question_id), None)
-        if not question:
-            continue
-        
-        selected_option = question["options"][answer.selected_option]
-        
-        # Add scores for career paths mentioned in the option
-        if "paths" in selected_option:
-            for path_id in selected_option["paths"]:
-                path_scores[path_id] = path_scores.get(path_id, 0) + 10
-        
-        # Track learning preferences
-        if "preference" in selected_option:
-            learning_style = selected_option["preference"]
-        
-        # Track time availability
-        if "time_multiplier" in selected_option:
-            time_multiplier = selected_option["time_multiplier"]
-    
-    # Get top 3 recommended paths
-    sorted_paths = sorted(path_scores.items(), key=lambda x: x[1], reverse=True)[:3]
-    
-    recommended_paths = []
-    for path_id, score in sorted_paths:
-        path = next((p for p in ENHANCED_CAREER_PATHS if p["id"] == path_id), None)
-        if path:
-            total_days = sum(m["estimated_days"] for m in path["milestones"])
-            estimated_weeks = int((total_days / 7) * time_multiplier)
-            
-            recommended_paths.append({
-                "path_id": path["id"],
-                "path_name": path["name"],
-                "score": score,
-                "estimated_weeks": estimated_weeks,
-                "reason": f"Great fit based on your interests and learning style"
-            })
-    
-    # Update user with recommendations
+    try:
+        selections = QUIZ.encode((a.question_id, a.selected_option) for a in submission.answers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result = QUIZ.recommendations(QUIZ.score(selections))[0]
+    
+    # Update user with recommendations; the answers are kept for rescoring
     await db.users.update_one(
         {"id": current_user["user_id"]},
-        {
-            "$set": {
-                "quiz_completed": True,
-                "recommended_paths": [p["path_id"] for p in recommended_paths],
-                "learning_style": learning_style
-            }
-        }
+        {"$set": {"quiz_completed": True, **QUIZ.stored_fields(result, selections)}}
     )
+    profile_cache.invalidate(current_user["user_id"])
     
-    return {
-        "recommended_paths": recommended_paths,
-        "learning_style": learning_style,
-        "estimated_completion_weeks": recommended_paths[0]["estimated_weeks"] if recommended_paths else 24
-    }
+    return result
 
 # --- Certificate Routes ---
 @api_router.post("/certificate/generate")
@@ -390,21 +621,18 @@ async def generate_certificate(request: CertificateRequest, current_user: dict =
     user_id = current_user["user_id"]
     
     # Check if user completed the path
-    progress = await db.user_progress.find_one({
-        "user_id": user_id,
-        "career_path_id": request.path_id
-    })
+    progress = await load_path_progress(user_id, request.path_id)
     
     if not progress:
         raise HTTPException(status_code=404, detail="No progress found for this path")
     
     # Get career path
-    career_path = next((p for p in ENHANCED_CAREER_PATHS if p["id"] == request.path_id), None)
+    career_path = CATALOG.get_path(request.path_id)
     if not career_path:
         raise HTTPException(status_code=404, detail="Career path not found")
     
-    completed_count = len(progress.get("completed_milestones", []))
-    total_count = len(career_path["milestones"])
+    completed_count = len(completed_milestone_ids(progress))
+    total_count = CATALOG.milestone_count[request.path_id]
     
     if completed_count < total_count:
         raise HTTPException(
@@ -438,19 +666,37 @@ async def generate_certificate(request: CertificateRequest, current_user: dict =
     }
 
 @api_router.get("/certificate/download/{certificate_id}")
-async def download_certificate(certificate_id: str):
-    """Get certificate data for download"""
+async def download_certificate(
+    certificate_id: str,
+    request: Request,
+    format: Literal["json", "pdf", "png"] = "json"
+):
+    """Get certificate data, or the rendered certificate as PDF or PNG"""
     certificate = await db.certificates.find_one({"id": certificate_id}, {"_id": 0})
     
     if not certificate:
         raise HTTPException(status_code=404, detail="Certificate not found")
-    
-    return certificate
+    if format == "json":
+        certificate.pop("artifacts", None)
+        return certificate
+    if format not in available_formats():
+        raise HTTPException(status_code=501, detail=f"{format.upper()} rendering is not available")
+    
+    headers = {
+        "Cache-Control": ARTIFACT_CACHE_CONTROL,
+        "Content-Disposition": f'attachment; filename="certificate-{certificate_id}.{format}"'
+    }
+    # A client holding the stored digest revalidates without the artifact being read
+    digest = certificate_renderer.stored_digest(certificate, format)
+    if digest and etag_matches(request, f'"{digest}"'):
+        return Response(status_code=304, headers={**headers, "ETag": f'"{digest}"'})
+    digest, data = await certificate_renderer.artifact(certificate, format)
+    return Response(content=data, media_type=MEDIA_TYPES[format], headers={**headers, "ETag": f'"{digest}"'})
 
 @api_router.get("/certificate/{certificate_id}")
 async def view_certificate(certificate_id: str):
     """Public view of certificate"""
-    certificate = await db.certificates.find_one({"id": certificate_id}, {"_id": 0})
+    certificate = await db.certificates.find_one({"id": certificate_id}, {"_id": 0, "artifacts": 0})
     
     if not certificate:
         raise HTTPException(status_code=404, detail="Certificate not found")
@@ -464,17 +710,14 @@ async def share_progress(share_data: ShareProgress, current_user: dict = Depends
     user_id = current_user["user_id"]
     
     # Get progress
-    progress = await db.user_progress.find_one({
-        "user_id": user_id,
-        "career_path_id": share_data.path_id
-    })
+    progress = await load_path_progress(user_id, share_data.path_id)
     
     if not progress:
         raise HTTPException(status_code=404, detail="No progress found for this path")
     
     # Get user and path info
     user = await db.users.find_one({"id": user_id}, {"_id": 0, "hashed_password": 0})
-    career_path = next((p for p in ENHANCED_CAREER_PATHS if p["id"] == share_data.path_id), None)
+    career_path = CATALOG.get_path(share_data.path_id)
     
     if not career_path:
         raise HTTPException(status_code=404, detail="Career path not found")
@@ -486,8 +729,8 @@ async def share_progress(share_data: ShareProgress, current_user: dict = Depends
         "user_name": user.get("name", "Anonymous"),
         "path_id": share_data.path_id,
         "path_name": career_path["name"],
-        "completed_milestones": len(progress.get("completed_milestones", [])),
-        "total_milestones": len(career_path["milestones"]),
+        "completed_milestones": len(completed_milestone_ids(progress)),
+        "total_milestones": CATALOG.milestone_count[share_data.path_id],
         "achievements": progress.get("achievements", []),
         "created_at": datetime.now(timezone.utc).isoformat()
     }
@@ -512,76 +755,81 @@ async def view_shared_progress(share_id: str):
 
 # --- Achievements Routes ---
 @api_router.get("/achievements")
-async def get_achievements():
+async def get_achievements(request: Request):
     """Get all available achievements"""
-    return {
-        "achievements": [
-            {
-                "id": "first_step",
-                "name": "First Step",
-                "description": "Complete your first milestone",
-                "icon": "🎯",
-                "color": "#10B981"
-            },
-            {
-                "id": "halfway_hero",
-                "name": "Halfway Hero",
-                "description": "Complete 50% of a career path",
-                "icon": "🚀",
-                "color": "#3B82F6"
-            },
-            {
-                "id": "path_master",
-                "name": "Path Master",
-                "description": "Complete an entire career path",
-                "icon": "👑",
-                "color": "#F59E0B"
-            },
-            {
-                "id": "speed_demon",
-                "name": "Speed Demon",
-                "description": "Complete a path in record time",
-                "icon": "⚡",
-                "color": "#EF4444"
-            },
-            {
-                "id": "multi_path",
-                "name": "Multi-Path Master",
-                "description": "Complete 3 different career paths",
-                "icon": "🌟",
-                "color": "#8B5CF6"
-            }
-        ]
-    }
+    rendered = CATALOG.rendered(
+        "achievements",
+        lambda: render_json({"achievements": CATALOG.achievements})
+    )
+    return cached_json_response(request, rendered)
 
 @api_router.get("/user/{user_id}/achievements")
 async def get_user_achievements(user_id: str):
     """Get all achievements earned by a user"""
-    progress_list = await db.user_progress.find({"user_id": user_id}, {"_id": 0}).to_list(100)
-    
-    all_achievements = set()
-    for progress in progress_list:
-        achievements = progress.get("achievements", [])
-        all_achievements.update(achievements)
-    
-    # Check for multi-path achievement
-    completed_paths = sum(1 for p in progress_list 
-                          if len(p.get("completed_milestones", [])) == 
-                          len(next((path for path in ENHANCED_CAREER_PATHS 
-                                   if path["id"] == p["career_path_id"]), {}).get("milestones", [])))
-    
-    if completed_paths >= 3:
-        all_achievements.add("multi_path")
-    
-    return {"user_id": user_id, "achievements": list(all_achievements)}
+    await progress_writes.settle(user_id)
+    return {"user_id": user_id, "achievements": await user_achievements(db, user_id)}
 
 
 @api_router.get("/user/{user_id}/certificates")
-async def get_user_certificates(user_id: str):
-    """Get all certificates earned by a user"""
-    certificates = await db.certificates.find({"user_id": user_id}, {"_id": 0}).to_list(100)
+async def get_user_certificates(
+    user_id: str,
+    response: Response,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json"
+):
+    """Get certificates earned by a user, oldest first, one page at a time (X-Next-Cursor) or as NDJSON"""
+    _check_cursor(cursor, parse_object_id)
+    query = {"user_id": user_id}
+    if format == "ndjson":
+        return _ndjson_response(stream_ndjson(
+            db.certificates, query, "_id", {"_id": 0, "artifacts": 0}, cursor=cursor, parse=parse_object_id
+        ))
+    
+    certificates, next_cursor = await fetch_page(
+        db.certificates, query, "_id", limit, cursor, {"_id": 0, "artifacts": 0}, parse_object_id
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return certificates
 
+# --- Admin Routes ---
+@api_router.get("/admin/funnels")
+async def get_funnels(
+    path_id: Optional[str] = None,
+    cohort: Optional[str] = None,
+    admin: dict = Depends(get_admin_user)
+):
+    """Milestone funnels written by the offline analytics job"""
+    if path_id and not CATALOG.get_path(path_id):
+        raise HTTPException(status_code=404, detail="Career path not found")
+    return {"funnels": await load_funnels(db, path_id, cohort)}
+
+@api_router.post("/admin/quiz/score")
+async def score_quiz_batch(batch: QuizBatchScore, admin: dict = Depends(get_admin_user)):
+    """Score many answer sets at once without storing anything, for simulations"""
+    try:
+        selections = np.array([
+            QUIZ.encode((a.question_id, a.selected_option) for a in answers)
+            for answers in batch.answer_sets
+        ], dtype=np.int64)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"results": QUIZ.recommendations(QUIZ.score(selections)) if batch.answer_sets else []}
+
+# --- Metrics Routes ---
+@api_router.get("/metrics/caches")
+async def get_cache_metrics(admin: dict = Depends(get_admin_user)):
+    """Hit/miss counters of this worker's in-process caches"""
+    return {
+        "caches": [progress_cache.stats(), profile_cache.stats(), token_cache.stats()],
+        "revoked_tokens": len(token_denylist),
+        "achievements": achievement_engine.stats(),
+        "password_pool": {**password_pool.stats(), **rehash_stats},
+        "rate_limits": rate_limit_stats(),
+        "certificates": certificate_renderer.stats()
+    }
+
 # Include router
 app.include_router(api_router)
 
@@ -591,6 +839,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "Content-Disposition"],
 )
 
 logging.basicConfig(
@@ -599,6 +848,32 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_db_indexes():
+    await ensure_indexes(db)
+
+@app.on_event("startup")
+async def save_quiz_layout():
+    await save_layout(db)
+
+@app.on_event("startup")
+async def start_progress_events():
+    progress_events.start(db)
+
+@app.on_event("startup")
+async def start_revocation_sync():
+    app.state.revocation_sync = asyncio.create_task(sync_revocations(db))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Buffered progress writes must reach Mongo before the client closes
+    await progress_writes.close()
+    await milestone_log.close()
+    await leaderboards.close()
+    await progress_events.close()
+    app.state.revocation_sync.cancel()
+    if rehash_tasks:
+        await asyncio.gather(*rehash_tasks, return_exceptions=True)
+    password_pool.shutdown()
+    certificate_renderer.shutdown()
     client.close()
@@ -29,67 +29,16 @@ const CertificateGenerator = ({ pathId, userId, onClose }) => {
     }
   };
 
-  const downloadCertificate = () => {
-    // Create a simple certificate HTML
-    const certificateHTML = `
-      <!DOCTYPE html>
-      <html>
-      <head>
-        <style>
-          body {
-            font-family: 'Georgia', serif;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            min-height: 100vh;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            margin: 0;
-          }
-          .certificate {
-            width: 800px;
-            padding: 60px;
-            background: white;
-            border: 20px solid #10B981;
-            border-image: linear-gradient(135deg, #10B981, #06B6D4) 1;
-            text-align: center;
-            box-shadow: 0 20px 60px rgba(0,0,0,0.3);
-          }
-          .logo { font-size: 48px; margin-bottom: 20px; }
-          h1 { font-size: 42px; color: #10B981; margin: 20px 0; }
-          h2 { font-size: 28px; color: #333; margin: 30px 0; }
-          .name { font-size: 36px; color: #764ba2; font-weight: bold; margin: 20px 0; }
-          .path { font-size: 24px; color: #555; margin: 20px 0; }
-          .date { font-size: 18px; color: #888; margin: 30px 0; }
-          .achievements { margin: 30px 0; font-size: 32px; }
-        </style>
-      </head>
-      <body>
-        <div class="certificate">
-          <div class="logo">⚡</div>
-          <h1>SUPERCHARGE</h1>
-          <h2>Certificate of Completion</h2>
-          <p style="font-size: 18px;">This is to certify that</p>
-          <div class="name">${certificate.user_name}</div>
-          <p style="font-size: 18px;">has successfully completed</p>
-          <div class="path">${certificate.path_name}</div>
-          <p style="font-size: 16px;">completing all ${certificate.total_milestones} milestones</p>
-          <div class="achievements">
-            ${certificate.achievements.map(a => {
-              const icons = { first_step: '🎯', halfway_hero: '🚀', path_master: '👑', speed_demon: '⚡', multi_path: '🌟' };
-              return icons[a] || '⭐';
-            }).join(' ')}
-          </div>
-          <div class="date">Completed on ${new Date(certificate.completion_date).toLocaleDateString('en-US', { year: 'numeric', month: 'long', day: 'numeric' })}</div>
-        </div>
-      </body>
-      </html>
-    `;
-
-    const blob = new Blob([certificateHTML], { type: 'text/html' });
-    const url = URL.createObjectURL(blob);
+  const downloadCertificate = async () => {
+    // The server renders the PDF once and serves the stored copy afterwards
+    const response = await axios.get(
+      `${API}/certificate/download/${certificate.certificate_id}`,
+      { params: { format: 'pdf' }, responseType: 'blob' }
+    );
+    const url = URL.createObjectURL(response.data);
     const a = document.createElement('a');
     a.href = url;
-    a.download = `${pathName}_Certificate.html`;
+    a.download = `${certificate.path_name}_Certificate.pdf`;
     a.click();
     URL.revokeObjectURL(url);
   };
@@ -30,7 +30,7 @@ const Dashboard = () => {
   const { user, token } = useAuth();
   const navigate = useNavigate();
   const [careerPaths, setCareerPaths] = useState([]);
-  const [userProgress, setUserProgress] = useState([]);
+  const [stats, setStats] = useState({ paths_completed: 0, milestones_completed: 0, average_progress: 0 });
   const [achievements, setAchievements] = useState([]);
   const [loading, setLoading] = useState(true);
 
@@ -38,17 +38,49 @@ const Dashboard = () => {
     fetchDashboardData();
   }, []);
 
+  // Live updates from other tabs and devices
+  useEffect(() => {
+    let source = null;
+    let retry = null;
+    let closed = false;
+    const refresh = () => fetchDashboardData();
+
+    const connect = async () => {
+      try {
+        // EventSource cannot send the token header, so open it with a one-time ticket
+        const response = await axios.post(`${API}/stream/ticket`, {}, {
+          headers: { Authorization: `Bearer ${token}` }
+        });
+        if (closed) return;
+        source = new EventSource(`${API}/stream/progress?ticket=${encodeURIComponent(response.data.ticket)}`);
+        ['milestone', 'progress', 'resync'].forEach(type => source.addEventListener(type, refresh));
+        // Tickets cannot be reused, so reconnect with a fresh one
+        source.onerror = () => {
+          source.close();
+          if (!closed) retry = setTimeout(connect, 5000);
+        };
+      } catch (error) {
+        console.error('Error opening progress stream:', error);
+      }
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retry);
+      if (source) source.close();
+    };
+  }, [token]);
+
   const fetchDashboardData = async () => {
     try {
-      const [pathsRes, progressRes, achievementsRes] = await Promise.all([
-        axios.get(`${API}/career-paths`),
-        axios.get(`${API}/progress/${user.id}`),
-        axios.get(`${API}/user/${user.id}/achievements`)
-      ]);
-
-      setCareerPaths(pathsRes.data);
-      setUserProgress(progressRes.data);
-      setAchievements(achievementsRes.data.achievements || []);
+      const response = await axios.get(`${API}/dashboard`, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+
+      setCareerPaths(response.data.paths);
+      setStats(response.data.stats);
+      setAchievements(response.data.achievements || []);
     } catch (error) {
       console.error('Error fetching dashboard data:', error);
     } finally {
@@ -57,27 +89,8 @@ const Dashboard = () => {
   };
 
   const getPathProgress = (pathId) => {
-    const progress = userProgress.find(p => p.career_path_id === pathId);
-    if (!progress) return 0;
-    
     const path = careerPaths.find(p => p.id === pathId);
-    if (!path) return 0;
-    
-    return Math.round((progress.completed_milestones.length / path.milestones.length) * 100);
-  };
-
-  const getCompletedCount = () => {
-    return userProgress.reduce((sum, p) => {
-      const path = careerPaths.find(cp => cp.id === p.career_path_id);
-      if (path && p.completed_milestones.length === path.milestones.length) {
-        return sum + 1;
-      }
-      return sum;
-    }, 0);
-  };
-
-  const getTotalMilestonesCompleted = () => {
-    return userProgress.reduce((sum, p) => sum + p.completed_milestones.length, 0);
+    return path ? path.percent_complete : 0;
   };
 
   if (loading) {
@@ -111,7 +124,7 @@ const Dashboard = () => {
               <Target className="text-white" size={24} />
               <span className="text-blue-100 text-sm font-medium">Paths</span>
             </div>
-            <div className="text-3xl font-bold text-white">{getCompletedCount()}</div>
+            <div className="text-3xl font-bold text-white">{stats.paths_completed}</div>
             <div className="text-blue-100 text-sm">Completed</div>
           </div>
 
@@ -120,7 +133,7 @@ const Dashboard = () => {
               <CheckCircle2 className="text-white" size={24} />
               <span className="text-green-100 text-sm font-medium">Milestones</span>
             </div>
-            <div className="text-3xl font-bold text-white">{getTotalMilestonesCompleted()}</div>
+            <div className="text-3xl font-bold text-white">{stats.milestones_completed}</div>
             <div className="text-green-100 text-sm">Achieved</div>
           </div>
 
@@ -139,7 +152,7 @@ const Dashboard = () => {
               <span className="text-orange-100 text-sm font-medium">Progress</span>
             </div>
             <div className="text-3xl font-bold text-white">
-              {userProgress.length > 0 ? Math.round(userProgress.reduce((sum, p) => sum + getPathProgress(p.career_path_id), 0) / userProgress.length) : 0}%
+              {stats.average_progress}%
             </div>
             <div className="text-orange-100 text-sm">Average</div>
           </div>
@@ -216,10 +229,10 @@ const Dashboard = () => {
                   <p className="text-gray-400 text-sm mb-4 line-clamp-2">{path.description}</p>
                   
                   <div className="flex items-center justify-between text-sm text-gray-500 mb-3">
-                    <span>{path.milestones.length} Milestones</span>
+                    <span>{path.milestone_count} Milestones</span>
                     <span className="flex items-center">
                       <Clock size={14} className="mr-1" />
-                      {path.milestones.reduce((sum, m) => sum + m.estimated_days, 0)} Days
+                      {path.total_estimated_days} Days
                     </span>
                   </div>
                   
@@ -0,0 +1,72 @@
+import time
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import auth
+import cache
+from auth import TokenDenylist, create_access_token, decode_token, token_cache, token_digest
+
+
+def test_denylist_keeps_keys_until_they_expire(monkeypatch):
+    now = 1_000_000.0
+    monkeypatch.setattr(auth.time, "time", lambda: now)
+    denylist = TokenDenylist()
+    denylist.add("a", now + 10)
+    denylist.add("b", now + 20)
+    assert "a" in denylist and "b" in denylist
+
+    now += 15
+    denylist.add("c", now + 30)
+    assert "a" not in denylist
+    assert "b" in denylist and "c" in denylist
+    assert len(denylist) == 2
+
+
+def test_denylist_readd_extends_the_expiry(monkeypatch):
+    now = 1_000_000.0
+    monkeypatch.setattr(auth.time, "time", lambda: now)
+    denylist = TokenDenylist()
+    denylist.add("a", now + 10)
+    denylist.add("a", now + 100)
+
+    now += 50
+    denylist.add("b", now + 10)
+    # The stale heap entry of the first add must not drop the key
+    assert "a" in denylist
+    assert len(denylist) == 2
+
+
+def test_denylist_purges_from_the_heap_head_only(monkeypatch):
+    now = 1_000_000.0
+    monkeypatch.setattr(auth.time, "time", lambda: now)
+    denylist = TokenDenylist()
+    for i in range(1000):
+        denylist.add(str(i), now + 1000 - i)
+
+    now += 500.5
+    denylist.add("new", now + 1000)
+    assert len(denylist) == 500 + 1
+    assert "0" in denylist and "999" not in denylist
+
+
+def test_token_cache_entry_expires_with_the_token(monkeypatch):
+    token_cache.clear()
+    token = create_access_token({"sub": "u1"}, expires_delta=timedelta(seconds=5))
+    assert decode_token(token)["sub"] == "u1"
+
+    started = time.monotonic()
+    # Past the token's exp, but well within TOKEN_CACHE_TTL_SECONDS
+    monkeypatch.setattr(cache.time, "monotonic", lambda: started + 10)
+    assert token_cache.get(token_digest(token), None) is None
+
+
+def test_revoked_token_is_rejected_even_when_cached():
+    token_cache.clear()
+    token = create_access_token({"sub": "u1"})
+    decode_token(token)
+    auth.revoke_token(token)
+    with pytest.raises(HTTPException) as error:
+        decode_token(token)
+    assert error.value.detail == "Token has been revoked"
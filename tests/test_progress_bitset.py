@@ -0,0 +1,77 @@
+import pytest
+
+import progress
+from catalog import CATALOG
+from progress import (
+    BITSET_MAX_MILESTONES,
+    completed_milestone_ids,
+    decode_mask,
+    encode_mask,
+    to_api,
+    uses_bitset,
+)
+
+PATH_ID = next(iter(CATALOG.milestone_ids))
+MILESTONES = CATALOG.milestone_ids[PATH_ID]
+OTHER_PATH_ID = next(p for p in CATALOG.milestone_ids if p != PATH_ID)
+
+
+def test_mask_round_trip_keeps_milestone_order():
+    chosen = [MILESTONES[-1], MILESTONES[0], MILESTONES[2]]
+    mask = encode_mask(PATH_ID, chosen)
+    assert mask == 1 << 0 | 1 << 2 | 1 << (len(MILESTONES) - 1)
+    assert decode_mask(PATH_ID, mask) == [MILESTONES[0], MILESTONES[2], MILESTONES[-1]]
+
+
+def test_encode_mask_ignores_other_paths_and_unknown_ids():
+    foreign = CATALOG.milestone_ids[OTHER_PATH_ID][0]
+    assert encode_mask(PATH_ID, [foreign, "no-such-milestone"]) == 0
+
+
+def test_decode_mask_ignores_bits_past_the_path():
+    mask = (1 << len(MILESTONES)) - 1
+    assert decode_mask(PATH_ID, mask | 1 << len(MILESTONES)) == MILESTONES
+    assert decode_mask(PATH_ID, 0) == []
+    assert decode_mask("no-such-path", mask) == []
+
+
+def test_completed_milestone_ids_reads_either_representation():
+    as_list = {"career_path_id": PATH_ID, "completed_milestones": [MILESTONES[1]]}
+    as_mask = {"career_path_id": PATH_ID, "completed_mask": encode_mask(PATH_ID, [MILESTONES[1]])}
+    assert completed_milestone_ids(as_list) == [MILESTONES[1]]
+    assert completed_milestone_ids(as_mask) == [MILESTONES[1]]
+    assert completed_milestone_ids({"career_path_id": PATH_ID}) == []
+
+
+def test_to_api_replaces_the_mask_with_the_list():
+    stored = {
+        "user_id": "u1",
+        "career_path_id": PATH_ID,
+        "completed_mask": encode_mask(PATH_ID, MILESTONES[:2]),
+        "achievements": ["first_step"],
+    }
+    assert to_api(stored) == {
+        "user_id": "u1",
+        "career_path_id": PATH_ID,
+        "completed_milestones": MILESTONES[:2],
+        "achievements": ["first_step"],
+    }
+    assert "completed_mask" in stored
+
+
+def test_to_api_passes_list_documents_through():
+    doc = {"career_path_id": PATH_ID, "completed_milestones": [MILESTONES[0]]}
+    assert to_api(doc) is doc
+    assert to_api(None) is None
+
+
+@pytest.mark.parametrize("storage, milestones, expected", [
+    ("list", 10, False),
+    ("bitset", 10, True),
+    ("bitset", BITSET_MAX_MILESTONES, True),
+    ("bitset", BITSET_MAX_MILESTONES + 1, False),
+])
+def test_uses_bitset(monkeypatch, storage, milestones, expected):
+    monkeypatch.setattr(progress, "PROGRESS_STORAGE", storage)
+    monkeypatch.setitem(CATALOG.milestone_count, PATH_ID, milestones)
+    assert uses_bitset(PATH_ID) is expected
@@ -0,0 +1,153 @@
+import numpy as np
+import pytest
+
+from catalog import CATALOG, CatalogIndex
+from quiz import DEFAULT_COMPLETION_WEEKS, QUIZ, UNANSWERED_BYTE, QuizScorer, _last_set
+
+PATH_IDS = list(CATALOG.path_by_id)
+STYLES = ["video", "article", "course", "all"]
+MULTIPLIERS = [2.0, 1.5, 1.2, 1.0]
+
+
+def old_recommendation(catalog, answers):
+    """The per-answer loop submit_quiz ran before QuizScorer"""
+    questions = {q["id"]: q for q in catalog.questions}
+    path_scores = {}
+    learning_style = "all"
+    time_multiplier = 1.5
+    for question_id, selected_option in answers:
+        question = questions.get(question_id)
+        if not question:
+            continue
+        selected_option = question["options"][selected_option]
+        for path_id in selected_option.get("paths", []):
+            path_scores[path_id] = path_scores.get(path_id, 0) + 10
+        if "preference" in selected_option:
+            learning_style = selected_option["preference"]
+        if "time_multiplier" in selected_option:
+            time_multiplier = selected_option["time_multiplier"]
+    return path_scores, learning_style, time_multiplier
+
+
+def random_catalog(rng):
+    """The real paths with questions that often set both modifiers"""
+    questions = []
+    for q in range(8):
+        options = []
+        for _ in range(int(rng.integers(2, 6))):
+            option = {"text": "option"}
+            if rng.random() < 0.7:
+                option["paths"] = list(rng.choice(PATH_IDS, size=int(rng.integers(1, 4)), replace=False))
+            if rng.random() < 0.3:
+                option["preference"] = str(rng.choice(STYLES))
+            if rng.random() < 0.3:
+                option["time_multiplier"] = float(rng.choice(MULTIPLIERS))
+            options.append(option)
+        questions.append({"id": f"q{q}", "question": "?", "options": options})
+    return CatalogIndex(CATALOG.paths, questions, CATALOG.achievements, "2024-01-01T00:00:00+00:00")
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_scores_match_the_old_loop(seed):
+    rng = np.random.default_rng(seed)
+    catalog = random_catalog(rng)
+    scorer = QuizScorer(catalog)
+    answer_sets = []
+    for _ in range(200):
+        # The quiz page submits one answer per question, in question order
+        answer_sets.append([
+            (q["id"], int(rng.integers(len(q["options"]))))
+            for q in catalog.questions if rng.random() < 0.8
+        ])
+
+    selections = np.stack([scorer.encode(answers) for answers in answer_sets])
+    scored = scorer.score(selections)
+    results = scorer.recommendations(scored)
+    for i, answers in enumerate(answer_sets):
+        path_scores, learning_style, time_multiplier = old_recommendation(catalog, answers)
+        assert {p: int(s) for p, s in zip(PATH_IDS, scored["scores"][i]) if s} == path_scores
+        assert results[i]["learning_style"] == learning_style
+        assert scored["time_multiplier"][i] == time_multiplier
+
+        # Same scores at the top; equal scores now follow catalog order
+        ranked = sorted(path_scores.items(), key=lambda x: (-x[1], PATH_IDS.index(x[0])))[:3]
+        expected = [
+            {
+                "path_id": path_id,
+                "score": score,
+                "estimated_weeks": int((catalog.total_days[path_id] / 7) * time_multiplier),
+            }
+            for path_id, score in ranked
+        ]
+        assert [
+            {k: p[k] for k in ("path_id", "score", "estimated_weeks")} for p in results[i]["recommended_paths"]
+        ] == expected
+        assert results[i]["estimated_completion_weeks"] == (
+            expected[0]["estimated_weeks"] if expected else DEFAULT_COMPLETION_WEEKS
+        )
+
+
+def test_ties_follow_catalog_order():
+    # devops and cloud-engineering tie; the old loop ranked them in answer order
+    answers = [("q2", 5)]
+    path_scores, _, _ = old_recommendation(CATALOG, answers)
+    assert list(path_scores) == ["devops", "cloud-engineering"]
+    result = QUIZ.recommendations(QUIZ.score(QUIZ.encode(answers)))[0]
+    assert [p["path_id"] for p in result["recommended_paths"]] == ["cloud-engineering", "devops"]
+
+
+def test_negative_options_are_rejected():
+    # The old loop indexed from the end, so -1 picked the last option
+    with pytest.raises(ValueError):
+        QUIZ.encode([("q1", -1)])
+    with pytest.raises(ValueError):
+        QUIZ.encode([("q1", len(CATALOG.questions[0]["options"]))])
+    # In a selections matrix -1 means unanswered, and anything lower is invalid
+    unanswered = np.full(len(QUIZ.question_ids), -1)
+    assert not QUIZ.score(unanswered)["scores"].any()
+    unanswered[0] = -2
+    with pytest.raises(ValueError):
+        QUIZ.score(unanswered)
+
+
+def test_encode_keeps_the_last_answer_and_skips_unknown_questions():
+    row = QUIZ.encode([("q1", 0), ("q1", 2), ("retired-question", 1)])
+    assert row[QUIZ.question_index["q1"]] == 2
+    assert (np.delete(row, QUIZ.question_index["q1"]) == -1).all()
+
+
+def test_last_set():
+    values = np.array([[1, 2, 3], [4, 5, 6], [7, 8, 9]])
+    is_set = np.array([[True, False, True], [False, False, False], [False, True, False]])
+    assert _last_set(values, is_set, 0).tolist() == [3, 0, 8]
+    assert _last_set(values[:, :1], is_set[:, :1], -1).tolist() == [1, -1, -1]
+
+
+def test_pack_round_trip():
+    rng = np.random.default_rng(0)
+    rows = np.stack([
+        np.where(rng.random(len(QUIZ.question_ids)) < 0.8, rng.integers(0, QUIZ.option_counts), -1)
+        for _ in range(20)
+    ])
+    packed = [bytes(QUIZ.pack(row)) for row in rows]
+    assert all(len(p) == len(QUIZ.question_ids) for p in packed)
+    assert bytes(QUIZ.pack(np.full(len(QUIZ.question_ids), -1))) == bytes([UNANSWERED_BYTE]) * len(QUIZ.question_ids)
+    assert (QUIZ.unpack(packed, QUIZ.question_ids) == rows).all()
+
+
+def test_unpack_maps_an_older_layout_onto_the_current_questions():
+    # An older layout in another order, without q1 and with a retired question
+    layout = tuple(reversed(QUIZ.question_ids[1:])) + ("retired-question",)
+    current = {"q2": 3, "q3": UNANSWERED_BYTE, "q4": 1, "q5": 200}
+    stored = [bytes([current.get(q, 0) for q in layout]), bytes([0] * len(layout))]
+
+    selections = QUIZ.unpack(stored, layout)
+    assert selections.shape == (2, len(QUIZ.question_ids))
+    column = QUIZ.question_index
+    # q1 is missing from the layout, q3 was unanswered and option 200 no longer exists
+    assert selections[0, column["q1"]] == -1
+    assert selections[0, column["q2"]] == 3
+    assert selections[0, column["q3"]] == -1
+    assert selections[0, column["q4"]] == 1
+    assert selections[0, column["q5"]] == -1
+    assert selections[1].tolist() == [-1] + [0] * (len(QUIZ.question_ids) - 1)